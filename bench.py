@@ -0,0 +1,666 @@
+"""Бенчмарки и фаззинг горячих путей бота.
+
+Запуск: python bench.py [parser catchup export e2e soak tenants hotpath ...]
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import timeit
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from fake_bot_api import FakeBotApi, FakeBotApiServer
+from history_export import check_roundtrip
+from set_parser import parse_sets
+
+# ========== РАЗБОР ПОДХОДОВ ==========
+PARSER_SAMPLES = [
+    "60 10", "60кг 10", "60*10", "60x10x3", "60,5 10", "60x10, 65x8",
+    "60 кг 10 раз 3 подхода", "135lb x 5", "60 на 10; 70 на 8\n80x5",
+    "60 10 и 70 8", "abc", "60", "60 10 foo",
+]
+PARSER_BUDGET_MS = 1.0
+FUZZ_ITERATIONS = 20000
+FUZZ_ALPHABET = "0123456789 .,;x×х*кгkgrlbsповтразподх\n+/и-"
+
+
+def _timed(func, iterations):
+    """Возвращает среднее время одного вызова в миллисекундах"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) * 1000 / iterations
+
+
+def _parse_or_none(text):
+    """Вызывает парсер, подавляя только ожидаемый ValueError"""
+    try:
+        return parse_sets(text)
+    except ValueError:
+        return None
+
+
+def fuzz_parser(iterations=FUZZ_ITERATIONS, seed=0):
+    """Проверяет парсер на случайных и сгенерированных корректных строках"""
+    rng = random.Random(seed)
+    separators = [" ", "x", "х", "×", "*", " на ", "кг ", "kg x "]
+    set_separators = [", ", "; ", "\n", " и ", " "]
+
+    for _ in range(iterations):
+        # Случайный мусор: допустим только ValueError
+        garbage = "".join(rng.choice(FUZZ_ALPHABET) for _ in range(rng.randint(0, 40)))
+        _parse_or_none(garbage)
+
+        # Корректный ввод: результат должен совпадать со сгенерированными значениями
+        expected = []
+        parts = []
+        for _ in range(rng.randint(1, 4)):
+            weight = rng.randint(1, 4000) / 4
+            reps = rng.randint(1, 30)
+            weight_text = f"{weight:g}".replace(".", rng.choice([".", ","]))
+            parts.append(f"{weight_text}{rng.choice(separators)}{reps}")
+            expected.append((weight, reps))
+        text = rng.choice(set_separators).join(parts)
+        result = parse_sets(text)
+        if result != expected:
+            raise AssertionError(f"{text!r}: {result} != {expected}")
+
+    print(f"fuzz parser: {iterations} итераций без ошибок")
+
+
+def bench_parser(iterations=2000):
+    """Измеряет время разбора типичных сообщений"""
+    worst = 0.0
+    for sample in PARSER_SAMPLES:
+        elapsed = _timed(lambda: _parse_or_none(sample), iterations)
+        worst = max(worst, elapsed)
+        print(f"parse_sets {sample!r:32} {elapsed * 1000:8.1f} мкс")
+
+    long_input = ", ".join(["60x10"] * 50)
+    elapsed = _timed(lambda: _parse_or_none(long_input), iterations // 10)
+    worst = max(worst, elapsed)
+    print(f"parse_sets {'50 подходов':32} {elapsed * 1000:8.1f} мкс")
+
+    if worst > PARSER_BUDGET_MS:
+        raise AssertionError(f"parse_sets медленнее {PARSER_BUDGET_MS} мс: {worst:.3f} мс")
+
+
+# ========== ДОГОНЯЮЩАЯ ОБРАБОТКА ==========
+CATCHUP_USERS = 500
+CATCHUP_UPDATES = 2000
+
+
+def _import_bot():
+    """Импортирует бот без реального токена"""
+    os.environ.setdefault('BOT_TOKEN', '0:bench')
+    import bot
+    return bot
+
+
+@contextmanager
+def _temporary_store(bot, user_data):
+    """Подменяет файлы хранилища на временные на время бенчмарка"""
+    names = ('DATA_FILE', 'STATE_FILE', 'GROUPS_FILE', 'ARCHIVE_DIR')
+    saved = {name: getattr(bot, name) for name in names}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in names:
+            setattr(bot, name, os.path.join(directory, os.path.basename(saved[name])))
+        bot.save_user_data(user_data)
+        try:
+            yield
+        finally:
+            for name, value in saved.items():
+                setattr(bot, name, value)
+
+
+HISTORY_START = datetime(2000, 1, 1, 18, 0)
+
+
+def _generate_history(programs, sessions, rng):
+    """Генерирует историю тренировок по программам бота: дни по очереди, через 2-3 дня"""
+    days = list(programs)
+    history = []
+    moment = HISTORY_START
+    for index in range(sessions):
+        day = days[index % len(days)]
+        exercises = programs[day]['exercises']
+        history.append({
+            'day': day,
+            'start_time': moment.isoformat(),
+            'exercises': [
+                {'name': name, 'weight': float(rng.randint(20, 120)), 'reps': rng.randint(5, 12),
+                 'timestamp': (moment + timedelta(minutes=5 * (i + 1))).isoformat()}
+                for i, name in enumerate(exercises)
+            ],
+            'completed_exercises': list(range(len(exercises))),
+        })
+        moment += timedelta(days=2 + index % 2)
+    return history
+
+
+def _generate_weights(points, rng):
+    """Генерирует ряд ежедневных взвешиваний"""
+    start = int(HISTORY_START.timestamp())
+    return {'t': [start + i * 86400 for i in range(points)],
+            'w': [round(80 + rng.uniform(-1.5, 1.5), 1) for _ in range(points)]}
+
+
+def _generate_users(programs, count, sessions, seed=0):
+    """Генерирует пользователей с историей тренировок по программам бота"""
+    rng = random.Random(seed)
+    return {
+        str(user): {'username': f"user{user}", 'history': _generate_history(programs, sessions, rng),
+                    'weight_history': {'t': [], 'w': []}}
+        for user in range(count)
+    }
+
+
+async def _timed_catch_up(bot, api, server, flows):
+    """Ставит flows сценариев в очередь и возвращает время catch_up_pending_updates, с"""
+    application = bot.build_application(bot.FAKE_BOT_TOKEN, server.base_url)
+    await application.initialize()
+    application.bot_data['update_state'] = {'last_update_id': 0}
+    for user_id in flows:
+        _push_training_flow(api, user_id)
+    started = time.perf_counter()
+    await bot.catch_up_pending_updates(application)
+    elapsed = time.perf_counter() - started
+    await application.shutdown()
+    if len(api.sent) < len(flows) * TRAINING_FLOW_MESSAGES:
+        raise AssertionError(f"catch-up: отправлено {len(api.sent)} из {len(flows) * TRAINING_FLOW_MESSAGES}")
+    return elapsed
+
+
+def bench_catchup(users=CATCHUP_USERS, updates=CATCHUP_UPDATES):
+    """Догоняющая обработка через поддельный Bot API: запись на каждое обновление и на пакет
+
+    Обновления - сценарии тренировок (_push_training_flow) пользователей
+    хранилища из users записей. Запись на каждое обновление - тот же путь
+    с CATCH_UP_BATCH_SIZE = 1.
+    """
+    bot = _import_bot()
+    user_data = _generate_users(bot.TRAINING_PROGRAMS, users, 10)
+    rng = random.Random(1)
+    flows = [rng.randrange(1, users) for _ in range(updates // 5)]
+    batch_size = bot.CATCH_UP_BATCH_SIZE
+
+    rates = {}
+    for size, sample in ((1, flows[:max(1, len(flows) // 20)]), (batch_size, flows)):
+        api = FakeBotApi(seed=0)
+        server = FakeBotApiServer(api).start()
+        bot.CATCH_UP_BATCH_SIZE = size
+        try:
+            with _temporary_store(bot, user_data):
+                rates[size] = len(sample) * 5 / asyncio.run(_timed_catch_up(bot, api, server, sample))
+        finally:
+            bot.CATCH_UP_BATCH_SIZE = batch_size
+            server.stop()
+
+    print(f"catch-up {users} польз., {updates} обновлений:")
+    print(f"  запись на каждое обновление: {rates[1]:10.0f} обн/с")
+    print(f"  запись на пакет из {batch_size}:       {rates[batch_size]:10.0f} обн/с")
+
+
+# ========== ЭКСПОРТ ИСТОРИИ ==========
+def check_export():
+    """Экспорт и импорт без потерь, включая значения, не помещающиеся в столбцы"""
+    bot = _import_bot()
+    user_data = _generate_users(bot.TRAINING_PROGRAMS, 20, 30)
+    user_data['0']['weight_history'] = _generate_weights(50, random.Random(0))
+    user_data['1']['username'] = "a\x00b"
+    user_data['1']['history'][0]['exercises'][0]['reps'] = 10 ** 20
+    user_data['1']['history'][1]['exercises'][0]['reps'] = -2 ** 63
+    user_data['2']['weight_history'] = {'t': [1.7e9, 2 ** 64], 'w': [80, 81.5]}
+    user_data['3']['weight_history'] = [{'date': '2025-01-01T00:00:00', 'weight': 80}]
+    del user_data['4']['weight_history']
+    ok, size = check_roundtrip(user_data)
+    if not ok:
+        raise AssertionError("export: данные после экспорта и импорта отличаются")
+    print(f"export: {len(user_data)} пользователей, {size} байт, без потерь")
+
+
+# ========== СКВОЗНЫЕ ТЕСТЫ С ПОДДЕЛЬНЫМ BOT API ==========
+E2E_USERS = 100
+E2E_LATENCY = 0.002
+E2E_PINGS = 50
+SOAK_SECONDS = 30
+SOAK_RATE_429 = 0.01
+# Сообщения бота на один сценарий тренировки: /train (1), выбор дня (2),
+# упражнение (1), ввод подходов (2), завершение (1)
+TRAINING_FLOW_MESSAGES = 7
+
+
+def _push_training_flow(api, user_id):
+    """Ставит в очередь полный сценарий тренировки одного пользователя"""
+    api.push_text(user_id, "/train")
+    api.push_text(user_id, "День А")
+    api.push_callback(user_id, "ex_0")
+    api.push_text(user_id, "60x10, 65x8")
+    api.push_callback(user_id, "finish")
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+@contextmanager
+def _fake_api_bot(api):
+    """Поднимает поддельный Bot API и временное хранилище"""
+    bot = _import_bot()
+    server = FakeBotApiServer(api).start()
+    try:
+        with _temporary_store(bot, {}):
+            yield bot, server
+    finally:
+        server.stop()
+
+
+async def _start_bot(bot, server, catch_up=True):
+    """Запускает приложение бота против поддельного API так же, как run_polling"""
+    application = bot.build_application(bot.FAKE_BOT_TOKEN, server.base_url)
+    await application.initialize()
+    if catch_up:
+        await bot.post_init(application)
+    await application.start()
+    await application.updater.start_polling(poll_interval=0, timeout=1, allowed_updates=bot.Update.ALL_TYPES)
+    return application
+
+
+async def _stop_bot(bot, application):
+    await application.updater.stop()
+    await application.stop()
+    await bot.post_shutdown(application)
+    await application.shutdown()
+
+
+async def _wait_sent(api, count, timeout=60.0):
+    return await asyncio.to_thread(api.wait_for_sent, count, timeout)
+
+
+def _sent_texts(api, start):
+    return [message['params'].get('text', '') for message in api.sent[start:]]
+
+
+def check_weight_flow():
+    """Взвешивание и тренировка не перехватывают ввод и /cancel друг у друга"""
+    api = FakeBotApi(seed=0)
+    with _fake_api_bot(api) as (bot, server):
+        async def step(user_id, text, replies=1):
+            expected = len(api.sent) + replies
+            api.push_text(user_id, text)
+            if not await _wait_sent(api, expected, 10.0):
+                raise AssertionError(f"weight: нет ответа на {text!r}")
+            return _sent_texts(api, expected - replies)
+
+        async def scenario():
+            application = await _start_bot(bot, server)
+            try:
+                # /weight -> /cancel отменяет только взвешивание
+                await step(1, "/weight")
+                _expect((await step(1, "/cancel"))[0], "❌ Взвешивание отменено.", "/cancel во время взвешивания")
+                # Обновления обрабатываются по порядку: ответ на "привет" пришел бы раньше ответа на /start
+                start = len(api.sent)
+                api.push_text(1, "привет")
+                await step(1, "/start")
+                if any('Введите вес' in text for text in _sent_texts(api, start)):
+                    raise AssertionError("weight: диалог взвешивания не завершился после /cancel")
+
+                # /weight при открытой тренировке: вес сохраняется, тренировка остается
+                await step(2, "/train")
+                await step(2, "День А", 2)
+                await step(2, "/weight")
+                reply = (await step(2, "82.5"))[0]
+                if not reply.startswith("✅ Вес 82.5кг сохранен"):
+                    raise AssertionError(f"weight: вес во время тренировки не сохранен: {reply!r}")
+                if 'current_session' not in bot.load_user_data()['2']:
+                    raise AssertionError("weight: взвешивание сбросило тренировку")
+                reply = (await step(2, "/weight 83"))[0]
+                if not reply.startswith("✅ Вес 83кг сохранен"):
+                    raise AssertionError(f"weight: /weight с аргументом: {reply!r}")
+            finally:
+                await _stop_bot(bot, application)
+            print("weight: взвешивание и тренировка не мешают друг другу")
+
+        asyncio.run(scenario())
+
+
+def bench_e2e(users=E2E_USERS, latency=E2E_LATENCY):
+    """Пропускная способность и задержка всего бота через поддельный Bot API"""
+    api = FakeBotApi(latency=latency, seed=0)
+    with _fake_api_bot(api) as (bot, server):
+        async def scenario():
+            # Догоняющая обработка: очередь накопилась до запуска
+            for user_id in range(1, users + 1):
+                _push_training_flow(api, user_id)
+            queued = api.pending_updates()
+            started = time.perf_counter()
+            application = await _start_bot(bot, server)
+            catch_up = time.perf_counter() - started
+            if len(api.sent) < users * TRAINING_FLOW_MESSAGES:
+                raise AssertionError(f"catch-up: отправлено {len(api.sent)} из {users * TRAINING_FLOW_MESSAGES}")
+            print(f"e2e catch-up: {queued} обновлений за {catch_up:.2f}с ({queued / catch_up:.0f} обн/с)")
+
+            # Живая обработка: сценарии тренировок для тех же пользователей
+            sent_before = len(api.sent)
+            started = time.perf_counter()
+            for user_id in range(1, users + 1):
+                _push_training_flow(api, user_id)
+            if not await _wait_sent(api, sent_before + users * TRAINING_FLOW_MESSAGES):
+                raise AssertionError("live: не все ответы получены")
+            elapsed = time.perf_counter() - started
+            print(f"e2e live: {users * 5} обновлений за {elapsed:.2f}с ({users * 5 / elapsed:.0f} обн/с)")
+
+            # Задержка ответа на отдельную команду
+            latencies = []
+            for _ in range(E2E_PINGS):
+                expected = len(api.sent) + 1
+                pushed = time.monotonic()
+                api.push_text(1, "/start")
+                await _wait_sent(api, expected)
+                latencies.append((api.sent[expected - 1]['time'] - pushed) * 1000)
+            print(f"e2e /start: p50 {_percentile(latencies, 0.5):.1f} мс, p95 {_percentile(latencies, 0.95):.1f} мс")
+
+            await _stop_bot(bot, application)
+
+        asyncio.run(scenario())
+
+
+def soak(seconds=SOAK_SECONDS, rate_429=SOAK_RATE_429):
+    """Длительная нагрузка с ответами 429: бот должен продолжать отвечать"""
+    api = FakeBotApi(latency=E2E_LATENCY, jitter=E2E_LATENCY, rate_429=rate_429, retry_after=0, seed=1)
+    with _fake_api_bot(api) as (bot, server):
+        async def scenario():
+            application = await _start_bot(bot, server)
+            rng = random.Random(2)
+            deadline = time.monotonic() + seconds
+            flows = 0
+            while time.monotonic() < deadline:
+                _push_training_flow(api, rng.randint(1, E2E_USERS))
+                flows += 1
+                await asyncio.sleep(0.01)
+            while api.pending_updates():
+                await asyncio.sleep(0.1)
+
+            # После нагрузки бот по-прежнему отвечает
+            api.rate_429 = 0
+            expected = len(api.sent) + 1
+            api.push_text(1, "/start")
+            if not await _wait_sent(api, expected, 10.0):
+                raise AssertionError("soak: бот перестал отвечать")
+            await _stop_bot(bot, application)
+            print(f"soak {seconds}с: {flows} сценариев, {len(api.sent)} ответов, 429: {api.throttled}")
+
+        asyncio.run(scenario())
+
+
+TENANT_NOISY_USERS = 100
+TENANT_FLOWS = 5
+
+
+def bench_tenants(noisy_users=TENANT_NOISY_USERS, flows=TENANT_FLOWS):
+    """Два бота в одном процессе: бот с большим хранилищем не должен вытеснять соседа
+
+    Оба бота одновременно обрабатывают по flows сценариев тренировки. Время
+    тихого бота сравнивается без ограничения доли (max_share=1) и с ним.
+    """
+    bot = _import_bot()
+    programs = bot.TRAINING_PROGRAMS
+
+    async def scenario(directory, max_share):
+        apis = [FakeBotApi(seed=0), FakeBotApi(seed=1)]
+        servers = [FakeBotApiServer(api).start() for api in apis]
+        tenants = [bot.new_tenant(name, os.path.join(directory, f"{name}-{max_share}"), max_share)
+                   for name in ('noisy', 'quiet')]
+        os.makedirs(tenants[0]['data_dir'])
+        with open(os.path.join(tenants[0]['data_dir'], bot.DATA_FILE), 'w', encoding='utf-8') as f:
+            json.dump(_generate_users(programs, noisy_users, bot.HOT_WINDOW), f, ensure_ascii=False, indent=2)
+        bot.hosted_tenants[:] = tenants
+        try:
+            await asyncio.gather(*(bot.start_tenant(tenant, bot.FAKE_BOT_TOKEN, server.base_url)
+                                   for tenant, server in zip(tenants, servers)))
+            for user_id in range(1, flows + 1):
+                _push_training_flow(apis[0], user_id)
+                _push_training_flow(apis[1], user_id)
+            started = time.perf_counter()
+
+            async def finish_time(api):
+                if not await _wait_sent(api, flows * TRAINING_FLOW_MESSAGES, 60.0):
+                    raise AssertionError(f"tenants: получено {len(api.sent)} ответов из {flows * TRAINING_FLOW_MESSAGES}")
+                return time.perf_counter() - started
+
+            finished = await asyncio.gather(*(finish_time(api) for api in apis))
+        finally:
+            await asyncio.gather(*(bot.stop_tenant(tenant) for tenant in tenants if tenant['application']))
+            bot.hosted_tenants[:] = [bot.DEFAULT_TENANT]
+            for server in servers:
+                server.stop()
+        # Изоляция: данные тихого бота не попали к шумному и наоборот
+        with open(os.path.join(tenants[1]['data_dir'], bot.DATA_FILE), encoding='utf-8') as f:
+            if len(json.load(f)) != flows:
+                raise AssertionError("tenants: данные ботов перемешались")
+        noisy, quiet = (tenant['metrics'] for tenant in tenants)
+        print(f"tenants max_share={max_share}: тихий бот {finished[1]:.2f}с, шумный {finished[0]:.2f}с; "
+              f"занято: шумный {noisy['busy_ms']:.0f} мс, тихий {quiet['busy_ms']:.0f} мс; "
+              f"придержано: {noisy['throttled_ms']:.0f} мс")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for max_share in (1.0, bot.TENANT_MAX_SHARE):
+            asyncio.run(scenario(directory, max_share))
+
+
+# ========== ГОРЯЧИЕ ФУНКЦИИ: КОРРЕКТНОСТЬ И РЕГРЕССИИ ==========
+# Время функций на историях разной длины сравнивается с базой из
+# bench_baseline.json; набор падает, если время выросло больше чем в
+# BENCH_THRESHOLD раз. База зависит от машины, поэтому обновляется там же,
+# где проверяется: BENCH_UPDATE_BASELINE=1 python bench.py hotpath
+HOTPATH_SIZES = (10, 100, 1000, 10000)
+HOTPATH_USER = '1'
+HOTPATH_REPEAT = 5
+HOTPATH_RETRIES = 3
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+REGRESSION_THRESHOLD = float(os.environ.get('BENCH_THRESHOLD', 2.0))
+UPDATE_BASELINE = os.environ.get('BENCH_UPDATE_BASELINE') == '1'
+
+
+def _expect(actual, expected, what):
+    if actual != expected:
+        raise AssertionError(f"{what}: {actual!r} != {expected!r}")
+
+
+def _reference_exercise_history(history, exercise_name, limit):
+    """Наивная выборка истории упражнения (новые первыми) для сверки"""
+    found = [
+        (session['start_time'], exercise['weight'], exercise['reps'], session['day'])
+        for session in history for exercise in session['exercises'] if exercise['name'] == exercise_name
+    ]
+    found.reverse()
+    return found[:limit] if limit else found
+
+
+def check_hotpath():
+    """Проверяет результаты горячих функций на известных входных данных"""
+    bot = _import_bot()
+    programs = bot.TRAINING_PROGRAMS
+    day = next(iter(programs))
+    exercise_name = programs[day]['exercises'][0]
+
+    # Анализ упражнения: плато, регресс, прогресс, мало данных
+    def records(*pairs):
+        return [{'weight': weight, 'reps': reps} for weight, reps in pairs]
+    _expect(bot.analyze_exercise_progress("X", records((60, 10), (60, 10))), None, "мало данных")
+    _expect(bot.analyze_exercise_progress("X", records((60, 8), (60, 10), (60, 12))),
+            "🎯 X: готовы к увеличению веса! Попробуйте +2.5кг", "плато")
+    _expect(bot.analyze_exercise_progress("X", records((60, 8), (65, 8), (62.5, 8))),
+            "⚠️ X: вес упал. Проверьте восстановление", "регресс")
+    _expect(bot.analyze_exercise_progress("X", records((60, 8), (62.5, 8), (65, 8))),
+            "🚀 X: отличный прогресс! +5.0кг", "прогресс")
+
+    # Частота тренировок: раз в неделю, каждый день, через 3 дня
+    def sessions(gap_days, count=4):
+        return [{'start_time': (HISTORY_START + timedelta(days=gap_days * i)).isoformat()} for i in range(count)]
+    _expect(bot.analyze_general_progress(HOTPATH_USER, sessions(7, 3)), None, "меньше 4 тренировок")
+    _expect(bot.analyze_general_progress(HOTPATH_USER, sessions(7)),
+            "📅 Тренируйтесь чаще (идеально 2-3 раза в неделю)", "редкие тренировки")
+    _expect(bot.analyze_general_progress(HOTPATH_USER, sessions(1)),
+            "🛌 Давайте мышцам больше времени на восстановление", "ежедневные тренировки")
+    _expect(bot.analyze_general_progress(HOTPATH_USER, sessions(3)), None, "нормальная частота")
+
+    # История упражнения: горячее окно и архив против наивной выборки
+    history = _generate_history(programs, bot.HOT_WINDOW * 3, random.Random(0))
+    record = {'username': '', 'history': [dict(session) for session in history], 'weight_history': {'t': [], 'w': []}}
+    with _temporary_store(bot, {}):
+        bot.archive_old_sessions(HOTPATH_USER, record)
+        bot.save_user_data({HOTPATH_USER: record})
+        for limit, full_history in ((3, False), (bot.CHART_POINTS, True), (None, True)):
+            result = bot.get_exercise_history(HOTPATH_USER, exercise_name, limit=limit, full_history=full_history)
+            _expect([(r['session_id'], r['weight'], r['reps'], r['day']) for r in result],
+                    _reference_exercise_history(history, exercise_name, limit), f"get_exercise_history limit={limit}")
+        _expect(bot.get_exercise_history('нет такого', exercise_name), [], "история незнакомого пользователя")
+        entries = bot.get_exercise_history(HOTPATH_USER, exercise_name)
+
+    _expect(bot.format_exercise_history([]), "📝 Ранее не выполнялось", "пустая история упражнения")
+    lines = bot.format_exercise_history(entries).split("\n")
+    _expect(len(lines), 3, "строк истории упражнения")
+    first = entries[0]
+    _expect(lines[0], f"1. {first['date']} ({first['day']}): {first['weight']}кг × {first['reps']}повт.", "строка истории")
+
+    # Вес тела
+    series = {'t': [int(HISTORY_START.timestamp()) + i * 86400 for i in range(7)], 'w': [80, 81, 80.5, 80.5, 79, 79.5, 80]}
+    _expect(bot.format_weight_history({'t': [], 'w': []}), "📊 История взвешиваний пуста", "пустая история веса")
+    lines = bot.format_weight_history(series).split("\n")
+    _expect(len(lines), 6, "строк истории веса")
+    _expect(lines[1], f"1. {datetime.fromtimestamp(series['t'][2]).strftime('%d.%m.%Y %H:%M')}: 80.5кг", "первая строка веса")
+    _expect(bot.get_weight_progress({'t': [1], 'w': [80]}), "💡 Продолжайте взвешиваться для отслеживания прогресса", "один замер")
+    _expect(bot.get_weight_progress(series), "📈 Набор массы: +0.5кг", "набор")
+    _expect(bot.get_weight_progress({'t': [1, 2], 'w': [80, 79.2]}), "📉 Снижение веса: -0.8кг", "снижение")
+    _expect(bot.get_weight_progress({'t': [1, 2], 'w': [80, 80]}), "⚖️ Вес стабилен", "стабильный вес")
+
+    # Клавиатура упражнений
+    exercises = programs[day]['exercises']
+    targets = {exercises[1]: {'weight': 62.5, 'reps': 8, 'note': ''}}
+    keyboard = bot.get_exercise_keyboard(day, [0], targets).inline_keyboard
+    _expect(len(keyboard), len(exercises) + 3, "рядов клавиатуры")
+    _expect(keyboard[0][0].text, f"✅ 1. {exercises[0].split(' (')[0]}", "выполненное упражнение")
+    _expect(keyboard[1][0].text, f"◻️ 2. {exercises[1].split(' (')[0]} (🎯62.5×8)", "упражнение с целью")
+    _expect([row[0].callback_data for row in keyboard[:len(exercises)]],
+            [f"ex_{i}" for i in range(len(exercises))], "callback_data упражнений")
+    _expect(keyboard[-1][0].callback_data, "finish", "кнопка завершения")
+
+    print("hotpath: результаты совпадают с ожидаемыми")
+
+
+def _measure(func):
+    """Лучшее из HOTPATH_REPEAT измерений времени одного вызова, мкс"""
+    timer = timeit.Timer(func)
+    loops, _ = timer.autorange()
+    return min(timer.repeat(HOTPATH_REPEAT, loops)) / loops * 1e6
+
+
+def _calibrate():
+    """Время эталонной нагрузки: база пересчитывается на текущую скорость машины"""
+    words = [f"{i:05d}" for i in range(2000)]
+    return _measure(lambda: sorted({word[::-1]: len(word) for word in words}.items()))
+
+
+def _hotpath_cases(bot, size):
+    """Вызовы горячих функций на истории из size тренировок"""
+    programs = bot.TRAINING_PROGRAMS
+    day = next(iter(programs))
+    exercise_name = programs[day]['exercises'][0]
+    rng = random.Random(size)
+    history = _generate_history(programs, size, rng)
+    weights = _generate_weights(size, rng)
+    entries = _reference_exercise_history(history, exercise_name, None)
+    exercise_history = [{'weight': weight, 'reps': reps} for _, weight, reps, _ in reversed(entries)]
+    record = {'username': '', 'history': history, 'weight_history': weights}
+    targets = bot.plan_next_session(record, day)
+    completed = list(range(0, len(programs[day]['exercises']), 2))
+    bot.archive_old_sessions(HOTPATH_USER, record)
+    bot.save_user_data({HOTPATH_USER: record})
+    formatted = bot.get_exercise_history(HOTPATH_USER, exercise_name, limit=None, full_history=True)
+    return {
+        'analyze_exercise_progress': lambda: bot.analyze_exercise_progress(exercise_name, exercise_history),
+        'analyze_general_progress': lambda: bot.analyze_general_progress(HOTPATH_USER, history),
+        'get_exercise_history': lambda: bot.get_exercise_history(HOTPATH_USER, exercise_name),
+        'get_exercise_history_full': lambda: bot.get_exercise_history(HOTPATH_USER, exercise_name, limit=None, full_history=True),
+        'format_exercise_history': lambda: bot.format_exercise_history(formatted),
+        'format_weight_history': lambda: bot.format_weight_history(weights),
+        'get_weight_progress': lambda: bot.get_weight_progress(weights),
+        'get_exercise_keyboard': lambda: bot.get_exercise_keyboard(day, completed, targets),
+    }
+
+
+def bench_hotpath(sizes=HOTPATH_SIZES):
+    """Измеряет горячие функции и сравнивает время с базой"""
+    bot = _import_bot()
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    for size in sizes:
+        # Скорость общей машины (CI, виртуалка) плавает, поэтому база
+        # масштабируется по времени эталонной нагрузки, измеренной рядом
+        calibration = results[f"_calibration/{size}"] = round(_calibrate(), 3)
+        reference_calibration = baseline.get(f"_calibration/{size}")
+        scale = calibration / reference_calibration if reference_calibration else 1.0
+        print(f"Калибровка: {calibration:.1f} мкс, масштаб базы {scale:.2f}")
+        # Хранилище читается один раз на пакет, поэтому меряется сама функция, а не диск
+        with _temporary_store(bot, {}), bot.storage_batch():
+            for name, func in _hotpath_cases(bot, size).items():
+                key = f"{name}/{size}"
+                elapsed = _measure(func)
+                reference = baseline.get(key, 0) * scale
+                # Единичный выброс (GC, соседний процесс) не считается регрессией
+                for _ in range(HOTPATH_RETRIES):
+                    if not reference or elapsed <= reference * REGRESSION_THRESHOLD:
+                        break
+                    elapsed = min(elapsed, _measure(func))
+                elapsed = results[key] = round(elapsed, 3)
+                status = f"база {reference:10.2f} мкс" if reference else "нет базы"
+                if reference and elapsed > reference * REGRESSION_THRESHOLD:
+                    regressions.append(f"{key}: {elapsed:.2f} мкс при базе {reference:.2f} мкс")
+                    status += "  ❌"
+                print(f"{name:28} {size:6} {elapsed:12.2f} мкс   {status}")
+
+    if UPDATE_BASELINE:
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"База обновлена: {BASELINE_FILE}")
+    elif regressions:
+        raise AssertionError(f"Замедление больше чем в {REGRESSION_THRESHOLD} раза:\n" + "\n".join(regressions))
+
+
+SUITES = {
+    'parser': [fuzz_parser, bench_parser],
+    'catchup': [bench_catchup],
+    'export': [check_export],
+    'e2e': [check_weight_flow, bench_e2e],
+    'soak': [soak],
+    'tenants': [bench_tenants],
+    'hotpath': [check_hotpath, bench_hotpath],
+}
+
+
+def main(argv):
+    """Запускает выбранные наборы бенчмарков (по умолчанию все)"""
+    names = argv or list(SUITES)
+    for name in names:
+        if name not in SUITES:
+            print(f"Неизвестный набор: {name}. Доступны: {', '.join(SUITES)}")
+            return 2
+        for suite in SUITES[name]:
+            suite()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -3,7 +3,22 @@ import json
 import os
 import sys
 import asyncio
-from datetime import datetime
+import contextvars
+import functools
+import gzip
+import bisect
+import html
+import re
+import heapq
+import signal
+import io
+import tempfile
+import time
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, time as dt_time
+from telegram.error import RetryAfter
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -12,11 +27,19 @@ from telegram.ext import (
     filters,
     ContextTypes,
     ConversationHandler,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    TypeHandler,
+    ApplicationHandlerStop
 )
 from flask import Flask
 from threading import Thread
 
+from log_pipeline import setup_logging, hash_user_id, log_context
+from set_parser import parse_sets, parse_weight, best_set
+from charts import sparkline, render_line_chart
+from history_export import ExportWriter, read_export
+from check_store import startup_problem
+
 # ========== FLASK APP FOR HEALTH CHECKS ==========
 app = Flask(__name__)
 
@@ -26,26 +49,28 @@ def health_check():
 
 @app.route('/health')
 def health():
-    return {"status": "ok", "bot": "running"}, 200
+    bots = {tenant['name']: tenant['metrics'] for tenant in hosted_tenants}
+    active_sessions = sum(metrics['active_sessions'] for metrics in bots.values())
+    return {"status": "ok", "bot": "running", "active_sessions": active_sessions, "bots": bots}, 200
 
 def run_flask():
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    app.run(host='0.0.0.0', port=HEALTH_PORT, debug=False)
 
 # ========== НАСТРОЙКА ЛОГГИРОВАНИЯ ==========
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # ========== КОНФИГУРАЦИЯ ==========
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
+# Адрес альтернативного Bot API (например, fake_bot_api.py для офлайн-тестов)
+BOT_API_BASE_URL = os.environ.get('BOT_API_BASE_URL')
+FAKE_BOT_TOKEN = '0:fake'
+HEALTH_PORT = int(os.environ.get('HEALTH_PORT', 5000))
+# JSON-список ботов для размещения нескольких ботов в одном процессе
+BOTS_CONFIG = os.environ.get('BOTS_CONFIG')
 
-if not BOT_TOKEN:
-    print("❌ ОШИБКА: BOT_TOKEN не найден!")
-    sys.exit(1)
-
-print("✅ BOT_TOKEN найден, запускаем бота...")
+# Администраторы (через запятую) могут выгружать и загружать данные всех пользователей
+ADMIN_IDS = {admin_id.strip() for admin_id in os.environ.get('ADMIN_IDS', '').split(',') if admin_id.strip()}
 
 TRAINING_PROGRAMS = {
     "День А": {
@@ -77,68 +102,376 @@ TRAINING_PROGRAMS = {
 # Состояния разговора
 CHOOSING_DAY, CHOOSING_EXERCISE, ENTERING_EXERCISE_DATA, WEIGHING = range(4)
 DATA_FILE = 'user_data.json'
+STATE_FILE = 'bot_state.json'
+GROUPS_FILE = 'group_data.json'
+ARCHIVE_DIR = 'archive'
+HOT_WINDOW = int(os.environ.get('HOT_WINDOW', 20))
+LEADERBOARD_SIZE = 10
+LEADERBOARD_SHOWN = 5
+CHART_POINTS = 30
+REMINDER_AFTER_DAYS = 3
+REMINDER_CHECK_INTERVAL = 600
+DIGEST_TIME = dt_time(hour=10)
+DIGEST_WEEKDAY = 1  # понедельник (в job queue 0 - воскресенье)
+PROGRESSION_STEP = 2.5
+DELOAD_FACTOR = 0.9
+DELOAD_AFTER_REGRESSIONS = 2
+SEND_SPACING = 0.05  # не больше ~20 сообщений в секунду при рассылках
+CATCH_UP_ON_RESTART = os.environ.get('CATCH_UP_ON_RESTART', '1') != '0'
+CATCH_UP_BATCH_SIZE = 100
+STATE_SAVE_INTERVAL = 30
+SESSION_IDLE_TIMEOUT = int(os.environ.get('SESSION_IDLE_TIMEOUT', 4 * 3600))
+SESSION_SWEEP_INTERVAL = 300
+CHART_CACHE_SIZE = 1000
+TENANT_MAX_SHARE = float(os.environ.get('TENANT_MAX_SHARE', 0.5))
+TENANT_WINDOW = 1.0
+
+# ========== БОТЫ ПРОЦЕССА ==========
+# Процесс может обслуживать несколько ботов (BOTS_CONFIG). У каждого бота своя
+# запись tenant: каталог данных, состояние пакетного режима хранилища, метрики
+# и учет занятого времени event loop. Текущий бот хранится в contextvar: он
+# задается один раз при запуске бота, и его наследуют все задачи asyncio этого
+# бота (обработка обновлений, job queue). Без BOTS_CONFIG работает один бот
+# DEFAULT_TENANT с данными в текущем каталоге, как и раньше.
+def new_tenant(name, data_dir='', max_share=1.0):
+    """Создает запись бота"""
+    return {
+        'name': name,
+        'data_dir': data_dir,
+        'max_share': max_share,
+        'application': None,
+        'storage': {'data': None, 'dirty': False, 'batch_depth': 0},
+        'usage': {'window': 0.0, 'busy': 0.0},
+        'metrics': {'active_sessions': 0, 'handler_calls': 0, 'handler_ms': 0.0, 'busy_ms': 0.0,
+                    'throttled_ms': 0.0, 'messages_sent': 0, 'messages_queued': 0},
+    }
+
+DEFAULT_TENANT = new_tenant('default')
+current_tenant = contextvars.ContextVar('tenant', default=DEFAULT_TENANT)
+# Боты, чьи метрики публикует /health
+hosted_tenants = [DEFAULT_TENANT]
+
+def get_tenant():
+    """Бот, в контексте которого выполняется код"""
+    return current_tenant.get()
+
+def data_path(name):
+    """Путь к файлу или каталогу данных текущего бота"""
+    return os.path.join(get_tenant()['data_dir'], name)
+
+@contextmanager
+def tenant_busy():
+    """Учитывает синхронную работу, которая занимает event loop, за текущим ботом"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        tenant = get_tenant()
+        tenant['usage']['busy'] += elapsed
+        tenant['metrics']['busy_ms'] += elapsed * 1000
+
+def tenant_wait_time(tenant, now):
+    """Сколько обновлениям бота подождать, чтобы его доля занятого времени не превышала max_share"""
+    usage = tenant['usage']
+    wait = usage['window'] + usage['busy'] / tenant['max_share'] - now
+    if wait <= 0 and now - usage['window'] >= TENANT_WINDOW:
+        usage.update(window=now, busy=0.0)
+    return max(wait, 0.0)
+
+def other_tenants_waiting(tenant):
+    """Есть ли очередь обновлений у других ботов процесса"""
+    return any(
+        other is not tenant and other['application'] and other['application'].update_queue.qsize()
+        for other in hosted_tenants
+    )
+
+async def tenant_admission(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Придерживает обновления бота, превысившего свою долю, пока ждут другие боты"""
+    tenant = get_tenant()
+    if tenant['max_share'] >= 1:
+        return
+    wait = tenant_wait_time(tenant, time.perf_counter())
+    if wait and other_tenants_waiting(tenant):
+        tenant['metrics']['throttled_ms'] += wait * 1000
+        await asyncio.sleep(wait)
 
 # ========== ФУНКЦИИ РАБОТЫ С ДАННЫМИ ==========
+# В пакетном режиме (storage_batch) данные читаются из файла один раз, а все
+# сохранения внутри пакета откладываются до одной записи на диск в конце.
+# Состояние пакетного режима у каждого бота свое (tenant['storage']).
 def load_user_data():
     """Загрузка данных пользователей из файла"""
-    if os.path.exists(DATA_FILE):
+    storage = get_tenant()['storage']
+    if storage['batch_depth'] and storage['data'] is not None:
+        return storage['data']
+    
+    data = {}
+    path = data_path(DATA_FILE)
+    if os.path.exists(path):
         try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with tenant_busy(), open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
         except (json.JSONDecodeError, Exception) as e:
             logger.error(f"Ошибка загрузки данных: {e}")
-    return {}
+    if storage['batch_depth']:
+        storage['data'] = data
+    return data
 
 def save_user_data(data):
     """Сохранение данных пользователей в файл"""
+    storage = get_tenant()['storage']
+    if storage['batch_depth']:
+        storage['data'] = data
+        storage['dirty'] = True
+        return
+    
     try:
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
+        with tenant_busy(), open(data_path(DATA_FILE), 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
     except Exception as e:
         logger.error(f"Ошибка сохранения данных: {e}")
 
+@contextmanager
+def storage_batch():
+    """Пакетный режим хранилища: одна запись на диск на весь пакет"""
+    storage = get_tenant()['storage']
+    storage['batch_depth'] += 1
+    try:
+        yield
+    finally:
+        storage['batch_depth'] -= 1
+        if not storage['batch_depth']:
+            data, dirty = storage['data'], storage['dirty']
+            storage.update(data=None, dirty=False)
+            if dirty:
+                save_user_data(data)
+
+# ========== АРХИВ СТАРЫХ ТРЕНИРОВОК ==========
+# В user_data остаются только последние HOT_WINDOW тренировок пользователя.
+# Более старые дописываются в сжатый архив ARCHIVE_DIR/<user_id>.jsonl.gz
+# (каждая выгрузка - отдельный gzip-член, файл только растет) и читаются
+# лишь функциями, которым нужна вся история: экспорт и длинные графики.
+# Размер архива на момент последнего сохранения хранится в записи, поэтому
+# хвост, дописанный перед сбоем до сохранения user_data, игнорируется.
+# Если описания архива в записи нет (хранилище восстановлено из копии или
+# запись переписана вручную), оно восстанавливается по самому архиву -
+# архив без описания никогда не обрезается.
+ARCHIVE_READ_BLOCK = 65536
+
+def get_archive_path(user_id):
+    """Путь к архиву тренировок пользователя"""
+    return os.path.join(data_path(ARCHIVE_DIR), f"{user_id}.jsonl.gz")
+
+def read_archive_members(data):
+    """Разбирает архив по gzip-членам: (тренировки, размер целых членов в байтах)
+
+    Разбор останавливается на первом неполном или испорченном члене.
+    """
+    view = memoryview(data)
+    sessions = []
+    offset = 0
+    while offset < len(data):
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        position = offset
+        parts = []
+        try:
+            while not decompressor.eof and position < len(data):
+                block = view[position:position + ARCHIVE_READ_BLOCK]
+                parts.append(decompressor.decompress(block))
+                position += len(block)
+            if not decompressor.eof:
+                break
+            member = [json.loads(line) for line in b''.join(parts).decode('utf-8').splitlines()]
+        except (zlib.error, ValueError):
+            break
+        sessions.extend(member)
+        offset = position - len(decompressor.unused_data)
+    return sessions, offset
+
+def restore_archive_state(user_id, record):
+    """Восстанавливает описание архива в записи по файлу архива"""
+    with tenant_busy(), open(get_archive_path(user_id), 'rb') as f:
+        sessions, size = read_archive_members(f.read())
+    days = {}
+    for session in sessions:
+        days[session['day']] = days.get(session['day'], 0) + 1
+    record['archived'] = {'sessions': len(sessions), 'days': days, 'bytes': size}
+    # Тренировки, которые уже лежат в архиве, не должны попасть туда второй раз
+    archived_keys = {(session['day'], session['start_time']) for session in sessions}
+    record['history'] = [session for session in record.get('history', [])
+                         if (session['day'], session['start_time']) not in archived_keys]
+    logger.warning(f"Восстановлено описание архива пользователя {hash_user_id(user_id)}: "
+                   f"{len(sessions)} тренировок, {size} байт")
+
+def archive_old_sessions(user_id, record):
+    """Переносит тренировки сверх HOT_WINDOW в архив пользователя"""
+    if 'archived' not in record and os.path.exists(get_archive_path(user_id)):
+        restore_archive_state(user_id, record)
+    history = record.get('history', [])
+    if len(history) <= HOT_WINDOW:
+        return 0
+    
+    old_sessions = history[:-HOT_WINDOW]
+    archived = record.setdefault('archived', {'sessions': 0, 'days': {}, 'bytes': 0})
+    path = get_archive_path(user_id)
+    os.makedirs(data_path(ARCHIVE_DIR), exist_ok=True)
+    if os.path.exists(path) and os.path.getsize(path) > archived['bytes']:
+        with open(path, 'r+b') as f:
+            f.truncate(archived['bytes'])
+    
+    lines = "".join(json.dumps(session, ensure_ascii=False) + "\n" for session in old_sessions)
+    with open(path, 'ab') as f:
+        f.write(gzip.compress(lines.encode('utf-8')))
+    
+    archived['bytes'] = os.path.getsize(path)
+    archived['sessions'] += len(old_sessions)
+    for session in old_sessions:
+        archived['days'][session['day']] = archived['days'].get(session['day'], 0) + 1
+    record['history'] = history[-HOT_WINDOW:]
+    return len(old_sessions)
+
+def load_full_history(user_id, record):
+    """Возвращает всю историю пользователя: архив и последние тренировки"""
+    history = record.get('history', [])
+    archived = record.get('archived')
+    if not archived or not archived['bytes']:
+        return list(history)
+    
+    # Пропавший или обрезанный архив не должен ронять /progress, /join и экспорт:
+    # такие расхождения показывает проверка хранилища при запуске (check_store)
+    try:
+        with tenant_busy(), open(get_archive_path(user_id), 'rb') as f:
+            lines = gzip.decompress(f.read(archived['bytes'])).decode('utf-8').splitlines()
+        return [json.loads(line) for line in lines] + history
+    except (OSError, EOFError, zlib.error, ValueError) as e:
+        logger.error(f"Архив тренировок недоступен, используются последние тренировки: {e!r}",
+                     extra={'event': 'archive_error', 'user': hash_user_id(user_id)})
+        return list(history)
+
+def get_session_counts(record):
+    """Возвращает (всего тренировок, {день: количество}) с учетом архива"""
+    archived = record.get('archived') or {'sessions': 0, 'days': {}}
+    days = dict(archived['days'])
+    for session in record.get('history', []):
+        days[session['day']] = days.get(session['day'], 0) + 1
+    return archived['sessions'] + len(record.get('history', [])), days
+
+def drop_archive(user_id, record):
+    """Удаляет архив пользователя (перед заменой записи при импорте)"""
+    if os.path.exists(get_archive_path(user_id)):
+        os.remove(get_archive_path(user_id))
+    record.pop('archived', None)
+
+def archive_all_users():
+    """Переносит в архив лишние тренировки всех пользователей (при запуске)"""
+    with storage_batch():
+        user_data = load_user_data()
+        moved = restored = 0
+        for user_id, record in user_data.items():
+            had_state = 'archived' in record
+            moved += archive_old_sessions(user_id, record)
+            restored += not had_state and 'archived' in record
+        if moved or restored:
+            save_user_data(user_data)
+    if moved:
+        logger.info(f"Перенесено в архив тренировок: {moved}")
+
+def load_group_data():
+    """Загрузка данных групповых чатов (участники и рейтинги)"""
+    path = data_path(GROUPS_FILE)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, Exception) as e:
+            logger.error(f"Ошибка загрузки данных групп: {e}")
+    return {}
+
+def save_group_data(data):
+    """Сохранение данных групповых чатов"""
+    try:
+        with open(data_path(GROUPS_FILE), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения данных групп: {e}")
+
+def load_bot_state():
+    """Загрузка служебного состояния бота (последний обработанный update_id)"""
+    path = data_path(STATE_FILE)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, Exception) as e:
+            logger.error(f"Ошибка загрузки состояния: {e}")
+    return {}
+
+def save_bot_state(state):
+    """Сохранение служебного состояния бота"""
+    try:
+        with open(data_path(STATE_FILE), 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения состояния: {e}")
+
+def new_user_record(username=''):
+    """Создает пустую запись пользователя"""
+    return {'username': username, 'history': [], 'weight_history': {'t': [], 'w': []}}
+
+def to_weight_series(weight_history):
+    """Приводит историю взвешиваний к временному ряду {'t': [эпоха], 'w': [вес]}
+
+    Старый формат (список словарей с ISO-датой) конвертируется на лету.
+    """
+    if isinstance(weight_history, dict):
+        return weight_history
+    series = {'t': [], 'w': []}
+    for record in weight_history or []:
+        series['t'].append(int(datetime.fromisoformat(record['date']).timestamp()))
+        series['w'].append(float(record['weight']))
+    return series
+
 def get_weight_history(user_id):
-    """Получает историю взвешиваний пользователя"""
+    """Получает историю взвешиваний пользователя в виде временного ряда"""
     user_data = load_user_data()
     if user_id not in user_data:
-        return []
-    return user_data[user_id].get('weight_history', [])
+        return {'t': [], 'w': []}
+    return to_weight_series(user_data[user_id].get('weight_history'))
 
-def save_weight(user_id, weight):
-    """Сохраняет вес пользователя"""
+def save_weight(user_id, weight, username=''):
+    """Сохраняет вес пользователя и возвращает обновленный временной ряд"""
     user_data = load_user_data()
     if user_id not in user_data:
-        user_data[user_id] = {'username': '', 'history': [], 'weight_history': []}
+        user_data[user_id] = new_user_record(username)
     
-    weight_record = {
-        'weight': weight,
-        'date': datetime.now().isoformat(),
-        'timestamp': datetime.now().strftime('%d.%m.%Y %H:%M')
-    }
-    
-    user_data[user_id]['weight_history'].append(weight_record)
+    series = to_weight_series(user_data[user_id].get('weight_history'))
+    series['t'].append(int(time.time()))
+    series['w'].append(float(weight))
+    user_data[user_id]['weight_history'] = series
+    update_leaderboards(user_id, user_data[user_id])
     save_user_data(user_data)
-    return weight_record
+    return series
 
-def format_weight_history(weight_history):
+def format_weight_history(weight_history, limit=5):
     """Форматирует историю взвешиваний для отображения"""
-    if not weight_history:
+    if not weight_history['t']:
         return "📊 История взвешиваний пуста"
     
     lines = []
-    for i, record in enumerate(weight_history[-5:], 1):
-        lines.append(f"{i}. {record['timestamp']}: {record['weight']}кг")
+    records = zip(weight_history['t'][-limit:], weight_history['w'][-limit:])
+    for i, (timestamp, weight) in enumerate(records, 1):
+        lines.append(f"{i}. {datetime.fromtimestamp(timestamp).strftime('%d.%m.%Y %H:%M')}: {weight:g}кг")
     
     return "📊 История взвешиваний:\n" + "\n".join(lines)
 
 def get_weight_progress(weight_history):
     """Анализирует прогресс веса"""
-    if len(weight_history) < 2:
+    weights = weight_history['w']
+    if len(weights) < 2:
         return "💡 Продолжайте взвешиваться для отслеживания прогресса"
     
-    current = weight_history[-1]['weight']
-    previous = weight_history[-2]['weight']
-    difference = current - previous
+    difference = weights[-1] - weights[-2]
     
     if difference > 0:
         return f"📈 Набор массы: +{difference:.1f}кг"
@@ -147,21 +480,92 @@ def get_weight_progress(weight_history):
     else:
         return "⚖️ Вес стабилен"
 
+def downsample_weights(weight_history, period='week', since=None):
+    """Агрегирует ряд взвешиваний по дням или неделям
+
+    Возвращает список (начало периода, средний вес). Начало выборки ищется
+    бинарным поиском, поэтому стоимость зависит только от длины окна.
+    """
+    timestamps = weight_history['t']
+    weights = weight_history['w']
+    start = bisect.bisect_left(timestamps, since) if since is not None else 0
+    
+    buckets = []
+    current_key = None
+    total = count = 0
+    for i in range(start, len(timestamps)):
+        day = datetime.fromtimestamp(timestamps[i]).date()
+        key = day - timedelta(days=day.weekday()) if period == 'week' else day
+        if key != current_key:
+            if count:
+                buckets.append((current_key, total / count))
+            current_key, total, count = key, 0.0, 0
+        total += weights[i]
+        count += 1
+    if count:
+        buckets.append((current_key, total / count))
+    return buckets
+
+def moving_average(values, window):
+    """Скользящее среднее за один проход"""
+    averages = []
+    total = 0.0
+    for i, value in enumerate(values):
+        total += value
+        if i >= window:
+            total -= values[i - window]
+        averages.append(total / min(i + 1, window))
+    return averages
+
+def format_weight_trend(weight_history, weeks=4):
+    """Форматирует средний вес по последним неделям"""
+    since = int(time.time()) - weeks * 7 * 86400
+    weekly = downsample_weights(weight_history, 'week', since)
+    if len(weekly) < 2:
+        return ""
+    lines = [f"  {week.strftime('%d.%m')}: {average:.1f}кг" for week, average in weekly]
+    return "📅 Средний вес по неделям:\n" + "\n".join(lines)
+
+# ========== ЭКСПОРТ И ИМПОРТ ==========
+def export_users(fileobj, user_ids=None):
+    """Записывает историю пользователей (по умолчанию всех) в колоночный файл экспорта"""
+    user_data = load_user_data()
+    if user_ids is None:
+        user_ids = list(user_data)
+    writer = ExportWriter(fileobj)
+    for user_id in user_ids:
+        if user_id in user_data:
+            record = {key: value for key, value in user_data[user_id].items() if key != 'archived'}
+            writer.add_user(user_id, record, load_full_history(user_id, user_data[user_id]))
+    writer.close()
+
+def import_users(fileobj):
+    """Загружает пользователей из файла экспорта одной записью в хранилище"""
+    imported = read_export(fileobj)
+    with storage_batch():
+        user_data = load_user_data()
+        for user_id, record in imported.items():
+            drop_archive(user_id, user_data.get(user_id, {}))
+            archive_old_sessions(user_id, record)
+        user_data.update(imported)
+        save_user_data(user_data)
+    return len(imported)
+
 # ========== ФУНКЦИИ ТАЙМЕРА ==========
 async def timer_callback(context: ContextTypes.DEFAULT_TYPE):
     """Колбэк для завершения таймера"""
     job = context.job
-    chat_id = job.context['chat_id']
-    timer_name = job.context['timer_name']
+    chat_id = job.data['chat_id']
+    timer_name = job.data['timer_name']
     
     try:
         await context.bot.send_message(
             chat_id=chat_id,
             text=f"🎯 {timer_name} завершен! Можно делать следующий подход! 💪"
         )
-        print(f"✅ Уведомление о завершении таймера отправлено в чат {chat_id}")
+        logger.debug("Уведомление о завершении таймера отправлено", extra={'event': 'timer_done', 'chat': hash_user_id(chat_id)})
     except Exception as e:
-        print(f"❌ Ошибка отправки уведомления таймера: {e}")
+        logger.warning(f"❌ Ошибка отправки уведомления таймера: {e}", extra={'event': 'timer_done', 'chat': hash_user_id(chat_id), 'outcome': 'error'})
 
 def set_timer(update: Update, context: ContextTypes.DEFAULT_TYPE, duration: int, timer_name: str):
     """Устанавливает таймер через job queue"""
@@ -173,13 +577,308 @@ def set_timer(update: Update, context: ContextTypes.DEFAULT_TYPE, duration: int,
     context.job_queue.run_once(
         timer_callback,
         duration,
-        context=timer_job_context,
+        data=timer_job_context,
         name=f"timer_end_{chat_id}"
     )
     
-    print(f"✅ Таймер {timer_name} установлен на {duration} секунд для чата {chat_id}")
+    logger.debug(f"Таймер {timer_name} установлен на {duration} секунд", extra={'event': 'timer_set', 'chat': hash_user_id(chat_id)})
     return f"⏰ Таймер {timer_name} установлен на {duration} секунд"
 
+# ========== НАПОМИНАНИЯ И ЕЖЕНЕДЕЛЬНЫЕ СВОДКИ ==========
+# Индекс напоминаний - куча (время, user_id), упорядоченная по времени
+# срабатывания. Проверка раз в REMINDER_CHECK_INTERVAL снимает с вершины только
+# тех, кому пора, не перебирая всех пользователей. Устаревшие записи кучи
+# отбрасываются сверкой со словарем due. Время отправленного напоминания
+# хранится в записи пользователя (reminded_at), поэтому после перезапуска
+# тем, кому уже напомнили о текущем перерыве, напоминание не повторяется.
+def get_reminder_index(bot_data):
+    """Возвращает индекс напоминаний из bot_data"""
+    return bot_data.setdefault('reminders', {'heap': [], 'due': {}})
+
+def schedule_reminder(bot_data, user_id, last_session_time):
+    """Планирует напоминание через REMINDER_AFTER_DAYS дней после тренировки"""
+    index = get_reminder_index(bot_data)
+    due = datetime.fromisoformat(last_session_time).timestamp() + REMINDER_AFTER_DAYS * 86400
+    index['due'][user_id] = due
+    heapq.heappush(index['heap'], (due, user_id))
+
+def cancel_reminder(bot_data, user_id):
+    """Отменяет запланированное напоминание (запись в куче станет устаревшей)"""
+    get_reminder_index(bot_data)['due'].pop(user_id, None)
+
+def reminder_pending(record):
+    """Время последней тренировки, если о перерыве после нее еще не напоминали, иначе None"""
+    if not record.get('history') or record.get('reminders_off'):
+        return None
+    last_session_time = record['history'][-1]['start_time']
+    if record.get('reminded_at', '') >= last_session_time:
+        return None
+    return last_session_time
+
+def build_reminder_index(bot_data):
+    """Строит индекс напоминаний по последним тренировкам при запуске"""
+    index = get_reminder_index(bot_data)
+    index['heap'].clear()
+    index['due'].clear()
+    for user_id, record in load_user_data().items():
+        last_session_time = reminder_pending(record)
+        if last_session_time:
+            schedule_reminder(bot_data, user_id, last_session_time)
+    return len(index['due'])
+
+def pop_due_reminders(bot_data, now):
+    """Снимает с индекса всех пользователей, которым пора напомнить"""
+    index = get_reminder_index(bot_data)
+    heap = index['heap']
+    due_users = []
+    while heap and heap[0][0] <= now:
+        due, user_id = heapq.heappop(heap)
+        if index['due'].get(user_id) == due:
+            del index['due'][user_id]
+            due_users.append(user_id)
+    return due_users
+
+def get_next_training_day(record):
+    """Определяет следующий день по схеме чередования: тот, что делали давнее всего"""
+    last_times = {}
+    for session in reversed(record.get('history', [])):
+        last_times.setdefault(session['day'], session['start_time'])
+        if len(last_times) == len(TRAINING_PROGRAMS):
+            break
+    for day in TRAINING_PROGRAMS:
+        if day not in last_times:
+            return day
+    return min(TRAINING_PROGRAMS, key=last_times.get)
+
+def build_weekly_digest(record, now):
+    """Формирует текст еженедельной сводки или None, если писать не о чем"""
+    week_ago = (now - timedelta(days=7)).isoformat()
+    sessions = []
+    for session in reversed(record.get('history', [])):
+        if session['start_time'] < week_ago:
+            break
+        sessions.append(session)
+    
+    if not sessions:
+        return None
+    
+    volume = sum(exercise_volume(exercise) for session in sessions for exercise in session['exercises'])
+    days = ", ".join(session['day'] for session in reversed(sessions))
+    digest = (
+        f"📬 <b>Итоги недели</b>\n\n"
+        f"🏋️ Тренировок: <b>{len(sessions)}</b> ({days})\n"
+        f"📦 Объем: <b>{volume:,.0f}кг</b>\n"
+    )
+    
+    weight_history = to_weight_series(record.get('weight_history'))
+    weekly = downsample_weights(weight_history, 'week', int(now.timestamp()) - 14 * 86400)
+    if len(weekly) >= 2:
+        difference = weekly[-1][1] - weekly[-2][1]
+        digest += f"⚖️ Средний вес: <b>{weekly[-1][1]:.1f}кг</b> ({difference:+.1f}кг за неделю)\n"
+    
+    return digest + "\nПродолжайте в том же духе! 💪"
+
+# ========== ИСХОДЯЩИЕ РАССЫЛКИ ==========
+# Рассылки всех ботов процесса идут через одну очередь. Сообщения одного бота
+# уходят не чаще раза в SEND_SPACING (лимит Telegram действует на токен), а
+# боты обслуживаются по кругу, поэтому большая рассылка одного бота не
+# задерживает напоминания остальных. Задача отправки живет, пока очередь не пуста.
+_outbox = {'queues': OrderedDict(), 'task': None}
+
+def spread_messages(application, messages):
+    """Ставит рассылку текущего бота в общую очередь отправки"""
+    if not messages:
+        return
+    tenant = get_tenant()
+    queue = _outbox['queues'].setdefault(tenant['name'], {
+        'tenant': tenant, 'bot': application.bot, 'messages': deque(), 'next_at': 0.0
+    })
+    queue['messages'].extend(messages)
+    tenant['metrics']['messages_queued'] = len(queue['messages'])
+    if _outbox['task'] is None or _outbox['task'].done():
+        # Задача общая для всех ботов, поэтому не наследует контекст текущего
+        _outbox['task'] = asyncio.create_task(send_outbox(), context=contextvars.Context())
+
+def drop_outbox(tenant):
+    """Отбрасывает неотправленную рассылку бота (при его остановке)"""
+    queue = _outbox['queues'].pop(tenant['name'], None)
+    if queue and queue['messages']:
+        logger.warning(f"Не отправлено сообщений рассылки: {len(queue['messages'])}", extra={'tenant': tenant['name']})
+    tenant['metrics']['messages_queued'] = 0
+
+async def send_outbox():
+    """Отправляет сообщения из очереди, по одному от каждого бота за проход"""
+    loop = asyncio.get_running_loop()
+    while _outbox['queues']:
+        for name, queue in list(_outbox['queues'].items()):
+            if _outbox['queues'].get(name) is not queue or queue['next_at'] > loop.time():
+                continue
+            chat_id, text = queue['messages'].popleft()
+            queue['next_at'] = loop.time() + SEND_SPACING
+            metrics = queue['tenant']['metrics']
+            try:
+                await queue['bot'].send_message(chat_id=chat_id, text=text, parse_mode='HTML')
+                metrics['messages_sent'] += 1
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                queue['messages'].appendleft((chat_id, text))
+                queue['next_at'] = loop.time() + retry_after
+            except Exception as e:
+                logger.warning(f"Не удалось отправить сообщение рассылки: {e}", extra={
+                    'event': 'outbox_send', 'chat': hash_user_id(chat_id), 'outcome': 'error', 'tenant': name})
+            metrics['messages_queued'] = len(queue['messages'])
+            if not queue['messages'] and _outbox['queues'].get(name) is queue:
+                del _outbox['queues'][name]
+        if _outbox['queues']:
+            next_at = min(queue['next_at'] for queue in _outbox['queues'].values())
+            await asyncio.sleep(max(next_at - loop.time(), 0))
+
+async def reminder_tick(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая проверка индекса напоминаний"""
+    due_users = pop_due_reminders(context.bot_data, time.time())
+    if not due_users:
+        return
+    
+    messages = []
+    reminded_at = datetime.now().isoformat()
+    with storage_batch():
+        user_data = load_user_data()
+        for user_id in due_users:
+            record = user_data.get(user_id)
+            if not record or not reminder_pending(record):
+                continue
+            record['reminded_at'] = reminded_at
+            day = get_next_training_day(record)
+            messages.append((int(user_id), (
+                f"⏰ Пора на тренировку! Следующая по плану: <b>{day}</b>\n"
+                f"{TRAINING_PROGRAMS[day]['description']}\n\n"
+                f"Начать: /train\nОтключить напоминания: /remind"
+            )))
+        if messages:
+            save_user_data(user_data)
+    spread_messages(context.application, messages)
+    logger.info(f"Запланировано напоминаний: {len(messages)}")
+
+async def weekly_digest_job(context: ContextTypes.DEFAULT_TYPE):
+    """Еженедельная рассылка сводок"""
+    now = datetime.now()
+    messages = []
+    for user_id, record in load_user_data().items():
+        if record.get('reminders_off'):
+            continue
+        digest = build_weekly_digest(record, now)
+        if digest:
+            messages.append((int(user_id), digest))
+    spread_messages(context.application, messages)
+    logger.info(f"Запланировано еженедельных сводок: {len(messages)}")
+
+def setup_scheduler(application):
+    """Строит индекс напоминаний и регистрирует периодические задачи"""
+    count = build_reminder_index(application.bot_data)
+    application.job_queue.run_repeating(reminder_tick, REMINDER_CHECK_INTERVAL, first=REMINDER_CHECK_INTERVAL, name="reminder_tick")
+    application.job_queue.run_daily(weekly_digest_job, DIGEST_TIME, days=(DIGEST_WEEKDAY,), name="weekly_digest")
+    logger.info(f"Планировщик запущен, напоминаний в очереди: {count}")
+
+# ========== ЖИЗНЕННЫЙ ЦИКЛ ТРЕНИРОВОК ==========
+# Активные тренировки индексируются кучей (время последней активности, user_id).
+# Периодическая очистка снимает с вершины только просроченные записи, поэтому
+# ее стоимость пропорциональна числу истекших сессий, а не всех пользователей.
+def get_session_index(bot_data):
+    """Возвращает индекс активных тренировок из bot_data"""
+    return bot_data.setdefault('sessions', {'heap': [], 'activity': {}})
+
+def touch_session(bot_data, user_id, session):
+    """Отмечает активность в текущей тренировке"""
+    now = time.time()
+    session['last_activity'] = datetime.fromtimestamp(now).isoformat()
+    index = get_session_index(bot_data)
+    index['activity'][user_id] = now
+    heapq.heappush(index['heap'], (now, user_id))
+    # Каждое касание добавляет запись в кучу; устаревшие периодически вычищаются
+    if len(index['heap']) > 2 * len(index['activity']) + 64:
+        index['heap'] = [(ts, uid) for uid, ts in index['activity'].items()]
+        heapq.heapify(index['heap'])
+    get_tenant()['metrics']['active_sessions'] = len(index['activity'])
+
+def untrack_session(bot_data, user_id):
+    """Убирает тренировку из индекса активных"""
+    index = get_session_index(bot_data)
+    index['activity'].pop(user_id, None)
+    get_tenant()['metrics']['active_sessions'] = len(index['activity'])
+
+def complete_training_session(user_data, user_id, bot_data):
+    """Переносит текущую тренировку в историю; пустая тренировка просто удаляется
+
+    Возвращает завершенную тренировку или None. Сохранение данных - на вызывающем.
+    """
+    record = user_data[user_id]
+    session = record.pop('current_session')
+    untrack_session(bot_data, user_id)
+    if not session['exercises']:
+        return None
+    
+    record['history'].append(session)
+    plan_next_session(record, session['day'])
+    update_leaderboards(user_id, record, session)
+    archive_old_sessions(user_id, record)
+    if not record.get('reminders_off'):
+        schedule_reminder(bot_data, user_id, session['start_time'])
+    return session
+
+def build_session_index(bot_data):
+    """Строит индекс активных тренировок по данным при запуске"""
+    index = get_session_index(bot_data)
+    index['heap'].clear()
+    index['activity'].clear()
+    for user_id, record in load_user_data().items():
+        session = record.get('current_session')
+        if session:
+            last_activity = datetime.fromisoformat(session.get('last_activity', session['start_time'])).timestamp()
+            index['activity'][user_id] = last_activity
+            index['heap'].append((last_activity, user_id))
+    heapq.heapify(index['heap'])
+    get_tenant()['metrics']['active_sessions'] = len(index['activity'])
+
+def pop_expired_sessions(bot_data, now):
+    """Снимает с индекса тренировки без активности дольше SESSION_IDLE_TIMEOUT"""
+    index = get_session_index(bot_data)
+    heap = index['heap']
+    deadline = now - SESSION_IDLE_TIMEOUT
+    expired = []
+    while heap and heap[0][0] <= deadline:
+        last_activity, user_id = heapq.heappop(heap)
+        if index['activity'].get(user_id) == last_activity:
+            del index['activity'][user_id]
+            expired.append(user_id)
+    get_tenant()['metrics']['active_sessions'] = len(index['activity'])
+    return expired
+
+async def session_sweep_job(context: ContextTypes.DEFAULT_TYPE):
+    """Автоматически завершает или удаляет заброшенные тренировки"""
+    expired = pop_expired_sessions(context.bot_data, time.time())
+    if expired:
+        messages = []
+        with storage_batch():
+            user_data = load_user_data()
+            for user_id in expired:
+                if 'current_session' not in user_data.get(user_id, {}):
+                    continue
+                session = complete_training_session(user_data, user_id, context.bot_data)
+                if session:
+                    messages.append((int(user_id), (
+                        f"⌛ Тренировка «{session['day']}» завершена автоматически после перерыва.\n"
+                        f"Сохранено упражнений: {len(session['exercises'])}. История: /progress"
+                    )))
+            save_user_data(user_data)
+        spread_messages(context.application, messages)
+        logger.info(f"Закрыто заброшенных тренировок: {len(expired)} (сохранено {len(messages)})")
+    logger.info(f"Активных тренировок: {get_tenant()['metrics']['active_sessions']}")
+
+def setup_session_lifecycle(application):
+    """Строит индекс активных тренировок и регистрирует периодическую очистку"""
+    build_session_index(application.bot_data)
+    application.job_queue.run_repeating(session_sweep_job, SESSION_SWEEP_INTERVAL, first=SESSION_SWEEP_INTERVAL, name="session_sweep")
+
 # ========== ИИ-АНАЛИТИКА И РЕКОМЕНДАЦИИ ==========
 def get_all_exercises():
     """Возвращает список всех упражнений из программ"""
@@ -189,6 +888,11 @@ def get_all_exercises():
             all_exercises.add(exercise)
     return list(all_exercises)
 
+def exercise_volume(exercise):
+    """Объем упражнения (вес × повторения по всем подходам)"""
+    sets = exercise.get('sets') or [exercise]
+    return sum(s['weight'] * s['reps'] for s in sets)
+
 def analyze_progress(user_id):
     """Анализирует прогресс и дает рекомендации"""
     user_data = load_user_data()
@@ -245,7 +949,7 @@ def analyze_general_progress(user_id, history):
     
     # Анализ частоты тренировок
     dates = [datetime.fromisoformat(session['start_time']) for session in history[-4:]]
-    date_diffs = [(dates[i] - dates[i+1]).days for i in range(len(dates)-1)]
+    date_diffs = [(dates[i+1] - dates[i]).days for i in range(len(dates)-1)]
     avg_frequency = sum(date_diffs) / len(date_diffs)
     
     if avg_frequency > 5:
@@ -255,14 +959,25 @@ def analyze_general_progress(user_id, history):
     
     return None
 
-def get_exercise_history(user_id, exercise_name, limit=3):
-    """Получает историю выполнения конкретного упражнения"""
+def get_exercise_history(user_id, exercise_name, limit=3, full_history=False):
+    """Получает историю выполнения конкретного упражнения
+
+    По умолчанию просматриваются только последние тренировки; full_history
+    подключает архив (для длинных графиков).
+    """
     user_data = load_user_data()
     
     if user_id not in user_data or not user_data[user_id].get('history'):
         return []
     
-    history = user_data[user_id]['history']
+    if full_history:
+        history = load_full_history(user_id, user_data[user_id])
+    else:
+        history = user_data[user_id]['history']
+    return collect_exercise_history(history, exercise_name, limit)
+
+def collect_exercise_history(history, exercise_name, limit=3):
+    """Выбирает подходы упражнения из списка тренировок, новые первыми"""
     exercise_history = []
     
     for session in reversed(history):
@@ -270,6 +985,7 @@ def get_exercise_history(user_id, exercise_name, limit=3):
             if exercise['name'] == exercise_name:
                 session_date = datetime.fromisoformat(session['start_time']).strftime('%d.%m.%Y')
                 exercise_history.append({
+                    'session_id': session['start_time'],
                     'date': session_date,
                     'weight': exercise['weight'],
                     'reps': exercise['reps'],
@@ -291,6 +1007,234 @@ def format_exercise_history(history):
     
     return "\n".join(lines)
 
+# ========== ПЛАНИРОВАНИЕ СЛЕДУЮЩЕЙ ТРЕНИРОВКИ ==========
+# Цели на следующую тренировку дня считаются один раз при ее завершении и
+# хранятся в записи пользователя, поэтому клавиатура и окно упражнения
+# показывают их простым поиском по словарю.
+REP_RANGE_PATTERN = re.compile(r'\((\d+)x(\d+)-(\d+)\)')
+
+def get_rep_range(exercise_name):
+    """Возвращает диапазон повторений из названия упражнения, например (4x8-12) -> (8, 12)"""
+    match = REP_RANGE_PATTERN.search(exercise_name)
+    if not match:
+        return None
+    return int(match.group(2)), int(match.group(3))
+
+def round_to_step(weight):
+    """Округляет вес до шага блинов"""
+    return max(PROGRESSION_STEP, round(weight / PROGRESSION_STEP) * PROGRESSION_STEP)
+
+def plan_exercise_target(exercise_name, results):
+    """Считает цель на следующую тренировку по последним результатам (от новых к старым)"""
+    last = results[0]
+    weight, reps = last['weight'], last['reps']
+    rep_range = get_rep_range(exercise_name)
+    
+    regressions = 0
+    for newer, older in zip(results, results[1:]):
+        if newer['weight'] >= older['weight']:
+            break
+        regressions += 1
+    
+    if regressions >= DELOAD_AFTER_REGRESSIONS:
+        # На малых весах 10% меньше шага блинов и округление вернуло бы тот же вес
+        deload_weight = round_to_step(weight * DELOAD_FACTOR)
+        if deload_weight >= weight:
+            deload_weight = weight - PROGRESSION_STEP
+        if deload_weight <= 0:
+            # Снижать некуда - повторяем последний результат, а не прогрессируем
+            return {'weight': weight, 'reps': reps, 'note': "повторите результат"}
+        return {
+            'weight': deload_weight,
+            'reps': rep_range[0] if rep_range else reps,
+            'note': "разгрузка после снижения веса"
+        }
+    if rep_range and reps >= rep_range[1]:
+        return {'weight': weight + PROGRESSION_STEP, 'reps': rep_range[0], 'note': f"+{PROGRESSION_STEP}кг"}
+    if rep_range:
+        return {'weight': weight, 'reps': min(reps + 1, rep_range[1]), 'note': "+1 повторение"}
+    return {'weight': weight, 'reps': reps + 1, 'note': "+1 повторение"}
+
+# Для цели нужны DELOAD_AFTER_REGRESSIONS + 1 последних результатов упражнения.
+# При чередовании дней это столько же тренировок каждого дня; двойной запас
+# покрывает нерегулярное чередование (два раза подряд один день)
+PLAN_LOOKBACK_SESSIONS = (DELOAD_AFTER_REGRESSIONS + 1) * len(TRAINING_PROGRAMS) * 2
+
+def plan_next_session(record, day):
+    """Пересчитывает цели на следующую тренировку дня и сохраняет их в record['targets']"""
+    results = {}
+    for session in reversed(record['history'][-PLAN_LOOKBACK_SESSIONS:]):
+        for exercise in session['exercises']:
+            exercise_results = results.setdefault(exercise['name'], [])
+            if len(exercise_results) <= DELOAD_AFTER_REGRESSIONS:
+                exercise_results.append(exercise)
+    
+    targets = {}
+    for exercise_name in TRAINING_PROGRAMS[day]['exercises']:
+        if exercise_name in results:
+            targets[exercise_name] = plan_exercise_target(exercise_name, results[exercise_name])
+    record.setdefault('targets', {})[day] = targets
+    return targets
+
+def get_day_targets(user_data, user_id, day):
+    """Цели пользователя на тренировку дня; для старых записей считаются один раз"""
+    record = user_data.get(user_id)
+    if not record:
+        return {}
+    if day not in record.get('targets', {}):
+        if not record.get('history'):
+            return {}
+        plan_next_session(record, day)
+        save_user_data(user_data)
+    return record['targets'][day]
+
+def format_target(target):
+    """Форматирует цель упражнения"""
+    return f"🎯 Цель: <b>{target['weight']:g}кг × {target['reps']}</b> ({target['note']})"
+
+# ========== ГРУППОВЫЕ РЕЙТИНГИ ==========
+# Для каждой группы хранятся только top-k списки [значение, user_id] по
+# рекордам упражнений, недельному объему и сериям. Они обновляются при
+# завершении тренировки и взвешивании участника, поэтому /top отвечает за
+# постоянное время независимо от размера группы и длины истории участников.
+# Личные рекорды участников хранятся отдельно (member_prs): участник, вытесненный
+# из top-k, возвращается в список, только когда побьет свой настоящий рекорд.
+def get_week_key(moment):
+    """Ключ ISO-недели, например 2025-W07"""
+    year, week, _ = moment.isocalendar()
+    return f"{year}-W{week:02d}"
+
+def new_group_record(title):
+    """Создает пустую запись группы"""
+    return {'title': title, 'members': {}, 'prs': {}, 'member_prs': {}, 'week': None, 'volume': {}, 'volume_top': [], 'streak_top': []}
+
+def update_top(entries, user_id, value, extra=None):
+    """Обновляет top-k список [значение, user_id, ...] для участника"""
+    entries[:] = [entry for entry in entries if entry[1] != user_id]
+    entries.append([value, user_id] + ([extra] if extra is not None else []))
+    entries.sort(key=lambda entry: entry[0], reverse=True)
+    del entries[LEADERBOARD_SIZE:]
+
+def update_pr(group, user_id, exercise):
+    """Обновляет рекорд участника в упражнении, если он побит"""
+    entries = group['prs'].setdefault(exercise['name'], [])
+    member_prs = group.setdefault('member_prs', {}).setdefault(user_id, {})
+    current = member_prs.get(exercise['name'])
+    if current is None:
+        # Группы, созданные до member_prs: рекорд известен, только если участник в top-k
+        current = next((entry[0] for entry in entries if entry[1] == user_id), 0)
+    if exercise['weight'] > current:
+        member_prs[exercise['name']] = exercise['weight']
+        update_top(entries, user_id, exercise['weight'])
+
+def get_active_weeks(now):
+    """Недели, в которых серия считается продолжающейся: текущая и прошлая"""
+    return {get_week_key(now), get_week_key(now - timedelta(days=7))}
+
+def update_streak_top(group, user_id, streak, now):
+    """Обновляет top-k серий, сначала убирая прерванные серии
+
+    Иначе длинные серии бросивших тренировки участников занимали бы весь
+    список и вытесняли более короткие активные.
+    """
+    active_weeks = get_active_weeks(now)
+    group['streak_top'][:] = [entry for entry in group['streak_top'] if entry[2] in active_weeks]
+    if streak['week'] in active_weeks:
+        update_top(group['streak_top'], user_id, streak['weeks'], streak['week'])
+
+def update_activity_streak(record, now):
+    """Обновляет серию недель подряд с тренировками или взвешиваниями"""
+    week = get_week_key(now)
+    streak = record.get('streak') or {'week': None, 'weeks': 0}
+    if streak['week'] != week:
+        previous_week = get_week_key(now - timedelta(days=7))
+        streak = {'week': week, 'weeks': streak['weeks'] + 1 if streak['week'] == previous_week else 1}
+        record['streak'] = streak
+    return streak
+
+def update_leaderboards(user_id, record, session=None):
+    """Обновляет рейтинги всех групп участника после тренировки или взвешивания"""
+    now = datetime.now()
+    streak = update_activity_streak(record, now)
+    if not record.get('groups'):
+        return
+    
+    week = get_week_key(now)
+    volume = sum(exercise_volume(exercise) for exercise in session['exercises']) if session else 0
+    group_data = load_group_data()
+    for chat_id in record['groups']:
+        group = group_data.get(chat_id)
+        if not group or user_id not in group['members']:
+            continue
+        if group['week'] != week:
+            group.update(week=week, volume={}, volume_top=[])
+        if session:
+            for exercise in session['exercises']:
+                update_pr(group, user_id, exercise)
+            group['volume'][user_id] = group['volume'].get(user_id, 0) + volume
+            update_top(group['volume_top'], user_id, group['volume'][user_id])
+        update_streak_top(group, user_id, streak, now)
+    save_group_data(group_data)
+
+def join_group(group_data, chat_id, title, user_id, name, record):
+    """Добавляет участника в рейтинги группы, учитывая его прошлые рекорды"""
+    group = group_data.setdefault(chat_id, new_group_record(title))
+    group['members'][user_id] = name
+    for session in load_full_history(user_id, record):
+        for exercise in session['exercises']:
+            update_pr(group, user_id, exercise)
+    streak = record.get('streak')
+    if streak:
+        update_streak_top(group, user_id, streak, datetime.now())
+    if chat_id not in record.setdefault('groups', []):
+        record['groups'].append(chat_id)
+
+def leave_group(group_data, chat_id, user_id, record):
+    """Убирает участника из рейтингов группы"""
+    group = group_data.get(chat_id)
+    if group:
+        group['members'].pop(user_id, None)
+        group['volume'].pop(user_id, None)
+        group.get('member_prs', {}).pop(user_id, None)
+        for entries in [group['volume_top'], group['streak_top'], *group['prs'].values()]:
+            entries[:] = [entry for entry in entries if entry[1] != user_id]
+    if chat_id in record.get('groups', []):
+        record['groups'].remove(chat_id)
+
+def format_leaderboard(group, now):
+    """Форматирует рейтинги группы"""
+    # Имена берутся только для показанных участников, а не для всей группы
+    def member(user_id):
+        return html.escape(group['members'].get(user_id, '?'))
+    medals = ["🥇", "🥈", "🥉"] + ["▫️"] * LEADERBOARD_SHOWN
+    text = f"🏆 <b>Рейтинг группы {html.escape(group['title'])}</b>\n\n"
+    
+    text += "📦 <b>Объем за неделю:</b>\n"
+    volume_top = group['volume_top'] if group['week'] == get_week_key(now) else []
+    if volume_top:
+        for medal, (volume, user_id) in zip(medals, volume_top[:LEADERBOARD_SHOWN]):
+            text += f"{medal} {member(user_id)}: {volume:,.0f}кг\n"
+    else:
+        text += "Пока никто не тренировался\n"
+    
+    text += "\n🔥 <b>Серии (недель подряд):</b>\n"
+    active_weeks = get_active_weeks(now)
+    streaks = [entry for entry in group['streak_top'] if entry[2] in active_weeks][:LEADERBOARD_SHOWN]
+    if streaks:
+        for medal, (weeks, user_id, _) in zip(medals, streaks):
+            text += f"{medal} {member(user_id)}: {weeks}\n"
+    else:
+        text += "Пока нет активных серий\n"
+    
+    text += "\n💪 <b>Рекорды:</b>\n"
+    records = [(name, entries[0]) for name, entries in group['prs'].items() if entries]
+    if records:
+        for name, (weight, user_id) in records:
+            text += f"• {name.split(' (')[0]}: {weight:g}кг - {member(user_id)}\n"
+    else:
+        text += "Пока нет рекордов\n"
+    return text
+
 def find_last_session_by_day(user_id, day):
     """Находит последнюю тренировку по дню"""
     user_data = load_user_data()
@@ -303,22 +1247,102 @@ def find_last_session_by_day(user_id, day):
             return session
     return None
 
+def estimate_one_rep_max(weight, reps):
+    """Оценка разового максимума (e1RM) по формуле Эпли"""
+    if reps <= 1:
+        return weight
+    return weight * (1 + reps / 30)
+
+# ========== ГРАФИКИ ПРОГРЕССА ==========
+def get_chart_keyboard():
+    """Создает клавиатуру выбора графика"""
+    keyboard = [[InlineKeyboardButton("⚖️ Вес тела", callback_data="chart_weight")]]
+    for day_index, (day, program) in enumerate(TRAINING_PROGRAMS.items()):
+        for i, exercise in enumerate(program['exercises']):
+            keyboard.append([InlineKeyboardButton(
+                f"{day[-1]}{i+1}. {exercise.split(' (')[0]}",
+                callback_data=f"chart_{day_index}_{i}"
+            )])
+    return InlineKeyboardMarkup(keyboard)
+
+def get_chart_version(record, chart_key):
+    """Версия данных графика: последняя тренировка или последнее взвешивание
+
+    Считается по записи без построения рядов, поэтому попадание в кэш
+    обходится без чтения архива.
+    """
+    if not record:
+        return None
+    if chart_key == 'weight':
+        timestamps = to_weight_series(record.get('weight_history'))['t']
+        return timestamps[-1] if timestamps else None
+    history = record.get('history')
+    return history[-1]['start_time'] if history else None
+
+def build_exercise_chart(user_id, record, exercise_name):
+    """Готовит данные графика упражнения: (подпись, ряды) или None"""
+    history = collect_exercise_history(load_full_history(user_id, record), exercise_name, CHART_POINTS)
+    if not history:
+        return None
+    history.reverse()
+    weights = [record['weight'] for record in history]
+    one_rep_maxes = [estimate_one_rep_max(record['weight'], record['reps']) for record in history]
+    
+    caption = (
+        f"📈 {exercise_name.split(' (')[0]}\n"
+        f"🔵 Рабочий вес: {sparkline(weights)} {weights[-1]:g}кг\n"
+        f"🔴 e1RM: {sparkline(one_rep_maxes)} {one_rep_maxes[-1]:.1f}кг"
+    )
+    return caption, [weights, one_rep_maxes]
+
+def build_weight_chart(record):
+    """Готовит данные графика веса тела: (подпись, ряды) или None"""
+    weight_history = to_weight_series(record.get('weight_history'))
+    if not weight_history['t']:
+        return None
+    since = weight_history['t'][-1] - CHART_POINTS * 3 * 86400
+    daily = [weight for _, weight in downsample_weights(weight_history, 'day', since)]
+    trend = moving_average(daily, 7)
+    
+    caption = (
+        f"⚖️ Вес тела\n"
+        f"🔵 По дням: {sparkline(daily[-CHART_POINTS:])} {daily[-1]:.1f}кг\n"
+        f"🔴 Среднее за 7 дней: {trend[-1]:.1f}кг"
+    )
+    return caption, [daily, trend]
+
+def get_cached_chart(bot_data, key, version):
+    """Возвращает (file_id, подпись) ранее отправленного графика, если данные не изменились"""
+    cache = bot_data.setdefault('chart_cache', OrderedDict())
+    cached = cache.get(key)
+    if cached and cached[0] == version:
+        cache.move_to_end(key)
+        return cached[1:]
+    return None
+
+def store_cached_chart(bot_data, key, version, file_id, caption):
+    """Запоминает file_id и подпись графика, вытесняя самые старые записи"""
+    cache = bot_data.setdefault('chart_cache', OrderedDict())
+    cache[key] = (version, file_id, caption)
+    cache.move_to_end(key)
+    while len(cache) > CHART_CACHE_SIZE:
+        cache.popitem(last=False)
+
 # ========== ФУНКЦИИ ИНТЕРФЕЙСА ==========
-def get_exercise_keyboard(day, completed_exercises, user_id=None):
+def get_exercise_keyboard(day, completed_exercises, targets=None):
     """Создает расширенную клавиатуру для выбора упражнений с быстрыми действиями"""
     exercises = TRAINING_PROGRAMS[day]['exercises']
     keyboard = []
+    targets = targets or {}
     
     for i, exercise in enumerate(exercises):
         status = "✅" if i in completed_exercises else "◻️"
         
-        # Добавляем подсказку с последним результатом
+        # Добавляем подсказку с целью на эту тренировку
         hint = ""
-        if user_id:
-            history = get_exercise_history(user_id, exercise, limit=1)
-            if history:
-                last_record = history[0]
-                hint = f" ({last_record['weight']}кг×{last_record['reps']})"
+        target = targets.get(exercise)
+        if target:
+            hint = f" (🎯{target['weight']:g}×{target['reps']})"
         
         keyboard.append([InlineKeyboardButton(
             f"{status} {i+1}. {exercise.split(' (')[0]}{hint}", 
@@ -376,7 +1400,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • ⚡ <b>Быстрое копирование</b> - прошлые веса в один клик
 • 🔄 <b>Повтор тренировок</b> - дублирование предыдущих занятий
 • ⏱ <b>Таймеры отдыха</b> - 1.5, 3 минуты и другие
-• 📊 <b>Графики прогресса</b> - визуализация результатов
+• 📊 <b>Графики прогресса</b> - визуализация результатов (/chart)
 
 <b>Основные команды:</b>
 /train - Начать новую тренировку
@@ -384,6 +1408,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /stats - Статистика прогресса
 /advice - Получить ИИ-рекомендации
 /weight - Записать текущий вес
+/chart - Графики прогресса
 /help - Помощь по использованию
     """
     await update.message.reply_text(welcome_text, parse_mode='HTML')
@@ -420,10 +1445,11 @@ async def show_exercise_list(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     user_data = load_user_data()
     if user_id not in user_data:
-        user_data[user_id] = {'username': update.effective_user.first_name, 'history': [], 'weight_history': []}
+        user_data[user_id] = new_user_record(update.effective_user.first_name)
     
     context.user_data['current_day'] = day
     user_data[user_id]['current_session'] = {'day': day, 'exercises': [], 'start_time': datetime.now().isoformat()}
+    touch_session(context.bot_data, user_id, user_data[user_id]['current_session'])
     save_user_data(user_data)
     
     program = TRAINING_PROGRAMS[day]
@@ -435,7 +1461,7 @@ async def show_exercise_list(update: Update, context: ContextTypes.DEFAULT_TYPE)
     exercises_list += f"\nВсего упражнений: {len(exercises)}\n\n👇 Выберите упражнение для ввода результатов:"
     
     completed_exercises = user_data[user_id]['current_session'].get('completed_exercises', [])
-    reply_markup = get_exercise_keyboard(day, completed_exercises, user_id)
+    reply_markup = get_exercise_keyboard(day, completed_exercises, get_day_targets(user_data, user_id, day))
     
     if update.message:
         await update.message.reply_text(exercises_list, parse_mode='HTML', reply_markup=ReplyKeyboardRemove())
@@ -478,12 +1504,14 @@ async def handle_exercise_selection(update: Update, context: ContextTypes.DEFAUL
         exercises = TRAINING_PROGRAMS[day]['exercises']
         exercise_name = exercises[exercise_index]
         
-        # Получаем историю упражнения
-        exercise_history = get_exercise_history(user_id, exercise_name)
+        # История и цель берутся из одной загрузки хранилища
+        user_data = load_user_data()
+        exercise_history = collect_exercise_history(user_data.get(user_id, {}).get('history', []), exercise_name)
         history_text = format_exercise_history(exercise_history)
         
-        # Получаем рекомендации
-        recommendations = analyze_exercise_progress(exercise_name, exercise_history) or "💪 Продолжайте в том же духе!"
+        # Цель на эту тренировку рассчитана заранее при завершении прошлой
+        target = get_day_targets(user_data, user_id, day).get(exercise_name)
+        recommendations = format_target(target) if target else "💪 Продолжайте в том же духе!"
         
         # Формируем расширенное сообщение с таймерами
         message_text = (
@@ -495,7 +1523,7 @@ async def handle_exercise_selection(update: Update, context: ContextTypes.DEFAUL
         message_text += (
             f"<b>Введите вес и количество повторений:</b>\n"
             f"<code>вес повторения</code>\n"
-            f"Пример: <code>60 10</code>\n\n"
+            f"Пример: <code>60 10</code>, <code>60x10x3</code> или <code>60x10, 65x8</code>\n\n"
             f"<b>Или выберите таймер отдыха:</b>"
         )
         
@@ -558,24 +1586,21 @@ async def handle_exercise_input(update: Update, context: ContextTypes.DEFAULT_TY
     exercise_name = exercises_list[exercise_index]
     
     try:
-        parts = text.split()
-        if len(parts) != 2:
-            raise ValueError("Нужно ввести два числа")
-        weight = float(parts[0])
-        reps = int(parts[1])
-        if weight <= 0 or reps <= 0:
-            raise ValueError("Числа должны быть положительными")
+        sets = parse_sets(text)
     except ValueError as e:
-        await update.message.reply_text(f"❌ Неверный формат: {e}\n\nВведите в формате: <code>вес повторения</code>\nПример: <code>60 10</code>", parse_mode='HTML')
+        await update.message.reply_text(f"❌ Неверный формат: {e}\n\nВведите в формате: <code>вес повторения</code>\nПримеры: <code>60 10</code>, <code>60x10x3</code>, <code>60x10, 65x8</code>", parse_mode='HTML')
         return ENTERING_EXERCISE_DATA
     
-    # Сохраняем результат текущего упражнения
+    # Сохраняем результат текущего упражнения (основной результат - самый тяжелый подход)
+    weight, reps = best_set(sets)
     exercise_data = {
         'name': exercise_name,
         'weight': weight,
         'reps': reps,
         'timestamp': datetime.now().isoformat()
     }
+    if len(sets) > 1:
+        exercise_data['sets'] = [{'weight': w, 'reps': r} for w, r in sets]
     
     existing_index = None
     for i, ex in enumerate(current_session['exercises']):
@@ -593,9 +1618,11 @@ async def handle_exercise_input(update: Update, context: ContextTypes.DEFAULT_TY
     if exercise_index not in current_session['completed_exercises']:
         current_session['completed_exercises'].append(exercise_index)
     
+    touch_session(context.bot_data, user_id, current_session)
     save_user_data(user_data)
     
-    await update.message.reply_text(f"✅ Сохранено: {weight}кг × {reps}повт.")
+    saved_text = ", ".join(f"{w}кг × {r}" for w, r in sets)
+    await update.message.reply_text(f"✅ Сохранено: {saved_text} повт.")
     
     return await show_exercise_list_after_input(update, context)
 
@@ -610,7 +1637,7 @@ async def show_exercise_list_after_input(update: Update, context: ContextTypes.D
     else:
         completed_exercises = []
     
-    reply_markup = get_exercise_keyboard(day, completed_exercises, user_id)
+    reply_markup = get_exercise_keyboard(day, completed_exercises, get_day_targets(user_data, user_id, day))
     
     # Проверяем тип обновления (сообщение или callback)
     if update.message:
@@ -658,6 +1685,7 @@ async def handle_quick_copy(update: Update, context: ContextTypes.DEFAULT_TYPE):
         current_session['exercises'] = last_session['exercises'].copy()
         # Помечаем упражнения как выполненные
         current_session['completed_exercises'] = list(range(len(TRAINING_PROGRAMS[day]['exercises'])))
+        touch_session(context.bot_data, user_id, current_session)
         save_user_data(user_data)
         await query.edit_message_text("✅ Веса скопированы из последней тренировки!")
     else:
@@ -689,6 +1717,7 @@ async def handle_repeat_last(update: Update, context: ContextTypes.DEFAULT_TYPE)
         'start_time': datetime.now().isoformat(),
         'completed_exercises': list(range(len(TRAINING_PROGRAMS[day]['exercises'])))
     }
+    touch_session(context.bot_data, user_id, user_data[user_id]['current_session'])
     save_user_data(user_data)
     
     await query.edit_message_text(f"✅ Тренировка '{day}' повторена!")
@@ -762,22 +1791,18 @@ async def finish_training_session(update: Update, context: ContextTypes.DEFAULT_
             )
         return ConversationHandler.END
     
-    current_session = user_data[user_id]['current_session']
-    day = current_session['day']
+    current_session = complete_training_session(user_data, user_id, context.bot_data)
+    save_user_data(user_data)
     
-    if not current_session['exercises']:
+    if not current_session:
         if update.callback_query:
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text="❌ Вы не выполнили ни одного упражнения. Тренировка отменена."
             )
-        del user_data[user_id]['current_session']
-        save_user_data(user_data)
         return ConversationHandler.END
     
-    user_data[user_id]['history'].append(current_session)
-    del user_data[user_id]['current_session']
-    save_user_data(user_data)
+    day = current_session['day']
     
     summary = "🎉 Тренировка завершена! 🎉\n\n<b>Ваши результаты:</b>\n"
     for i, exercise in enumerate(current_session['exercises'], 1):
@@ -826,13 +1851,16 @@ async def view_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
             response += f"  ... и ещё {len(session['exercises']) - 3} упражнений\n"
         response += "\n"
     
-    response += f"Всего тренировок: {len(history)}\n\n"
+    response += f"Всего тренировок: {get_session_counts(user_data[user_id])[0]}\n\n"
     
     # Добавляем историю веса
     weight_history = get_weight_history(user_id)
-    if weight_history:
+    if weight_history['t']:
         response += format_weight_history(weight_history)
         response += f"\n\n{get_weight_progress(weight_history)}"
+        trend = format_weight_trend(weight_history)
+        if trend:
+            response += f"\n\n{trend}"
     
     await update.message.reply_text(response, parse_mode='HTML')
 
@@ -846,21 +1874,26 @@ async def view_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     history = user_data[user_id]['history']
+    total_sessions, day_counts = get_session_counts(user_data[user_id])
     stats_text = "📈 <b>Ваша статистика:</b>\n\n"
-    stats_text += f"Всего тренировок: <b>{len(history)}</b>\n"
+    stats_text += f"Всего тренировок: <b>{total_sessions}</b>\n"
     
-    day_a_count = sum(1 for session in history if session['day'] == 'День А')
-    day_b_count = sum(1 for session in history if session['day'] == 'День Б')
+    day_a_count = day_counts.get('День А', 0)
+    day_b_count = day_counts.get('День Б', 0)
     stats_text += f"День А: <b>{day_a_count}</b> тренировок\n"
     stats_text += f"День Б: <b>{day_b_count}</b> тренировок\n\n"
     
     # Добавляем статистику веса
     weight_history = get_weight_history(user_id)
-    if weight_history:
-        current_weight = weight_history[-1]['weight']
-        stats_text += f"⚖️ Текущий вес: <b>{current_weight}кг</b>\n"
-        if len(weight_history) > 1:
-            first_weight = weight_history[0]['weight']
+    if weight_history['t']:
+        current_weight = weight_history['w'][-1]
+        stats_text += f"⚖️ Текущий вес: <b>{current_weight:g}кг</b>\n"
+        daily = downsample_weights(weight_history, 'day', int(time.time()) - 30 * 86400)
+        if len(daily) >= 7:
+            average = moving_average([weight for _, weight in daily], 7)[-1]
+            stats_text += f"📊 Среднее за 7 дней взвешиваний: <b>{average:.1f}кг</b>\n"
+        if len(weight_history['w']) > 1:
+            first_weight = weight_history['w'][0]
             difference = current_weight - first_weight
             if difference > 0:
                 stats_text += f"📈 Изменение веса: <b>+{difference:.1f}кг</b>\n"
@@ -869,11 +1902,204 @@ async def view_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 stats_text += f"⚖️ Вес не изменился\n"
     
-    if len(history) >= 2:
+    if total_sessions >= 2:
         stats_text += "🔄 <b>Последние тренировки сохранены!</b>\n"
     stats_text += "\nПродолжайте в том же духе! 💪"
     await update.message.reply_text(stats_text, parse_mode='HTML')
 
+async def weight_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /weight - запись текущего веса"""
+    if context.args:
+        return await record_weight(update, context, " ".join(context.args))
+    
+    await update.message.reply_text(
+        "⚖️ Введите ваш текущий вес в кг\nПример: <code>82.5</code>\n\nДля отмены: /cancel",
+        parse_mode='HTML'
+    )
+    return WEIGHING
+
+async def handle_weight_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка ввода веса"""
+    return await record_weight(update, context, update.message.text)
+
+async def cancel_weight(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отмена взвешивания: начатая тренировка не затрагивается"""
+    await update.message.reply_text("❌ Взвешивание отменено.")
+    return ConversationHandler.END
+
+async def record_weight(update: Update, context: ContextTypes.DEFAULT_TYPE, text):
+    """Разбирает и сохраняет вес, отвечает сводкой по динамике"""
+    try:
+        weight = parse_weight(text)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return WEIGHING
+    
+    user_id = str(update.effective_user.id)
+    weight_history = save_weight(user_id, weight, update.effective_user.first_name)
+    
+    response = f"✅ Вес {weight:g}кг сохранен!\n\n{get_weight_progress(weight_history)}"
+    trend = format_weight_trend(weight_history)
+    if trend:
+        response += f"\n\n{trend}"
+    
+    await update.message.reply_text(response)
+    return ConversationHandler.END
+
+async def chart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /chart - графики прогресса"""
+    await update.message.reply_text("📈 Выберите график:", reply_markup=get_chart_keyboard())
+
+async def handle_chart_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отправляет выбранный график, повторно используя уже загруженные изображения"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = str(update.effective_user.id)
+    if query.data == "chart_weight":
+        chart_key = 'weight'
+    else:
+        day_index, exercise_index = map(int, query.data.split("_")[1:])
+        day = list(TRAINING_PROGRAMS)[day_index]
+        chart_key = TRAINING_PROGRAMS[day]['exercises'][exercise_index]
+    
+    # Версия берется из записи до построения рядов: при попадании в кэш
+    # данные графика не собираются вовсе
+    record = load_user_data().get(user_id)
+    version = get_chart_version(record, chart_key)
+    cache_key = (user_id, chart_key)
+    cached = get_cached_chart(context.bot_data, cache_key, version) if version is not None else None
+    if cached:
+        file_id, caption = cached
+        await query.message.reply_photo(photo=file_id, caption=caption)
+        return
+    
+    if version is None:
+        chart = None
+    elif chart_key == 'weight':
+        chart = build_weight_chart(record)
+    else:
+        # Длинный график читает и распаковывает архив - не на event loop
+        chart = await asyncio.to_thread(build_exercise_chart, user_id, record, chart_key)
+    if not chart:
+        await query.message.reply_text("📊 Недостаточно данных для графика")
+        return
+    
+    caption, series = chart
+    png = await asyncio.to_thread(render_line_chart, series)
+    message = await query.message.reply_photo(photo=png, caption=caption)
+    store_cached_chart(context.bot_data, cache_key, version, message.photo[-1].file_id, caption)
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /export - выгрузка своей истории в файл"""
+    user_id = str(update.effective_user.id)
+    buffer = io.BytesIO()
+    await asyncio.to_thread(export_users, buffer, [user_id])
+    buffer.seek(0)
+    
+    await update.message.reply_document(
+        document=buffer,
+        filename=f"workout_{user_id}_{datetime.now().strftime('%Y%m%d')}.wbx",
+        caption="💾 Резервная копия вашей истории тренировок и веса"
+    )
+
+async def export_all_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /export_all - выгрузка данных всех пользователей (только для администраторов)"""
+    if str(update.effective_user.id) not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Команда доступна только администраторам")
+        return
+    
+    with tempfile.TemporaryFile() as f:
+        await asyncio.to_thread(export_users, f)
+        f.seek(0)
+        await update.message.reply_document(
+            document=f,
+            filename=f"workout_backup_{datetime.now().strftime('%Y%m%d_%H%M')}.wbx",
+            caption="💾 Резервная копия всех пользователей"
+        )
+
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /import - загрузка файла экспорта (ответом на сообщение с файлом, только для администраторов)"""
+    if str(update.effective_user.id) not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Команда доступна только администраторам")
+        return
+    
+    reply = update.message.reply_to_message
+    if not reply or not reply.document:
+        await update.message.reply_text("📎 Отправьте команду /import ответом на сообщение с файлом экспорта")
+        return
+    
+    with tempfile.TemporaryFile() as f:
+        document = await reply.document.get_file()
+        await document.download_to_memory(f)
+        f.seek(0)
+        try:
+            count = await asyncio.to_thread(import_users, f)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ Ошибка импорта: {e}")
+            return
+    
+    await update.message.reply_text(f"✅ Импортировано пользователей: {count}")
+
+async def remind_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /remind - включение и отключение напоминаний и сводок"""
+    user_id = str(update.effective_user.id)
+    user_data = load_user_data()
+    if user_id not in user_data:
+        user_data[user_id] = new_user_record(update.effective_user.first_name)
+    
+    record = user_data[user_id]
+    record['reminders_off'] = not record.get('reminders_off', False)
+    save_user_data(user_data)
+    
+    if record['reminders_off']:
+        cancel_reminder(context.bot_data, user_id)
+        await update.message.reply_text("🔕 Напоминания и еженедельные сводки отключены")
+    else:
+        last_session_time = reminder_pending(record)
+        if last_session_time:
+            schedule_reminder(context.bot_data, user_id, last_session_time)
+        await update.message.reply_text("🔔 Напоминания и еженедельные сводки включены")
+
+async def join_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /join в группе - участие в рейтингах"""
+    user = update.effective_user
+    user_id = str(user.id)
+    chat_id = str(update.effective_chat.id)
+    
+    user_data = load_user_data()
+    if user_id not in user_data:
+        user_data[user_id] = new_user_record(user.first_name)
+    group_data = load_group_data()
+    join_group(group_data, chat_id, update.effective_chat.title or "", user_id, user.first_name, user_data[user_id])
+    save_group_data(group_data)
+    save_user_data(user_data)
+    
+    await update.message.reply_text(f"✅ {user.first_name} участвует в рейтинге группы! Тренировки записывайте в личном чате с ботом. Рейтинг: /top")
+
+async def leave_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /leave в группе - выход из рейтингов"""
+    user_id = str(update.effective_user.id)
+    chat_id = str(update.effective_chat.id)
+    
+    user_data = load_user_data()
+    group_data = load_group_data()
+    leave_group(group_data, chat_id, user_id, user_data.get(user_id, {}))
+    save_group_data(group_data)
+    if user_id in user_data:
+        save_user_data(user_data)
+    
+    await update.message.reply_text(f"👋 {update.effective_user.first_name} больше не участвует в рейтинге группы")
+
+async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /top в группе - рейтинги участников"""
+    group = load_group_data().get(str(update.effective_chat.id))
+    if not group or not group['members']:
+        await update.message.reply_text("🏆 В рейтинге пока никого нет. Присоединяйтесь: /join")
+        return
+    
+    await update.message.reply_text(format_leaderboard(group, datetime.now()), parse_mode='HTML')
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /help - справка"""
     help_text = """
@@ -885,14 +2111,22 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /stats - Статистика прогресса
 /advice - Получить ИИ-рекомендации
 /weight - Записать текущий вес
+/chart - Графики прогресса
+/export - Скачать резервную копию своих данных
+/remind - Включить или отключить напоминания
 /help - Эта справка
 
+<b>В групповых чатах:</b>
+/join - Участвовать в рейтинге группы
+/top - Рейтинг: рекорды, объем за неделю, серии
+/leave - Выйти из рейтинга
+
 <b>Новые возможности:</b>
 • 🧠 <b>ИИ-помощник</b> - умные рекомендации по прогрессу
 • ⚡ <b>Быстрое копирование</b> - прошлые веса в один клик
 • 🔄 <b>Повтор тренировок</b> - дублирование предыдущих занятий
 • ⏱ <b>Таймеры отдыха</b> - 1.5, 2, 3, 5 минут для отдыха между подходами
-• 📊 <b>Графики прогресса</b> - ASCII-визуализация ваших результатов
+• 📊 <b>Графики прогресса</b> - /chart: вес, e1RM и вес тела
 
 <b>Как работать с ботом:</b>
 1. Нажмите /train
@@ -921,6 +2155,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if user_id in user_data and 'current_session' in user_data[user_id]:
         del user_data[user_id]['current_session']
         save_user_data(user_data)
+    untrack_session(context.bot_data, user_id)
     
     await update.message.reply_text("❌ Тренировка отменена.", reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
@@ -931,57 +2166,332 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update and update.effective_message:
         await update.effective_message.reply_text("❌ Произошла ошибка. Попробуйте еще раз или начните заново: /start")
 
+# ========== ДОГОНЯЮЩАЯ ОБРАБОТКА ПОСЛЕ ПЕРЕЗАПУСКА ==========
+# Последний обработанный update_id (high-water mark) хранится в STATE_FILE.
+# Во время догоняющей обработки обновления чуть ниже отметки (не дальше
+# DUPLICATE_WINDOW) считаются повторной доставкой и отбрасываются, поэтому
+# перезапуск не дублирует подходы. Telegram может начать нумерацию заново
+# (после недели без обновлений, при смене токена или сервера), поэтому id
+# намного ниже отметки сбрасывает ее, а в живом режиме отметка просто
+# следует за последним обновлением.
+DUPLICATE_WINDOW = 1000
+
+async def track_update_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отбрасывает повторно доставленные при догоняющей обработке обновления и двигает high-water mark"""
+    state = context.bot_data.setdefault('update_state', {'last_update_id': 0})
+    if state.get('catching_up') and update.update_id <= state['last_update_id']:
+        if update.update_id > state['last_update_id'] - DUPLICATE_WINDOW:
+            logger.info(f"Пропущено повторное обновление {update.update_id}")
+            raise ApplicationHandlerStop
+        logger.warning(f"Нумерация обновлений началась заново: {update.update_id} после {state['last_update_id']}")
+    state['last_update_id'] = update.update_id
+    state['dirty'] = True
+
+def persist_update_state(bot_data):
+    """Сохраняет high-water mark, если он изменился"""
+    state = bot_data.get('update_state')
+    if state and state.get('dirty'):
+        save_bot_state({'last_update_id': state['last_update_id']})
+        state['dirty'] = False
+
+async def persist_update_state_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическое сохранение high-water mark в режиме живой обработки"""
+    persist_update_state(context.bot_data)
+
+async def catch_up_pending_updates(application):
+    """Обрабатывает накопившиеся за время простоя обновления пакетами
+
+    Каждый пакет из CATCH_UP_BATCH_SIZE обновлений проходит через обычные
+    обработчики с одной записью хранилища на пакет. Когда очередь пуста,
+    бот переходит к обычному polling.
+    """
+    state = application.bot_data['update_state']
+    await application.bot.delete_webhook(drop_pending_updates=False)
+    # Первый запрос без offset: Telegram сам помнит, что подтверждено. Отметка
+    # из STATE_FILE могла устареть, если нумерация обновлений началась заново
+    offset = None
+    processed = 0
+    started = time.perf_counter()
+    
+    state['catching_up'] = True
+    try:
+        while True:
+            updates = await application.bot.get_updates(
+                offset=offset, limit=CATCH_UP_BATCH_SIZE, timeout=0, allowed_updates=Update.ALL_TYPES
+            )
+            if not updates:
+                break
+            with storage_batch():
+                for update in updates:
+                    await application.process_update(update)
+            persist_update_state(application.bot_data)
+            offset = updates[-1].update_id + 1
+            processed += len(updates)
+    finally:
+        state['catching_up'] = False
+    
+    if processed:
+        elapsed = time.perf_counter() - started
+        logger.info(f"Обработано накопившихся обновлений: {processed} за {elapsed:.1f}с")
+
+async def post_init(application):
+    """Подготовка после инициализации: догоняющая обработка и планировщик"""
+    application.bot_data['update_state'] = {'last_update_id': load_bot_state().get('last_update_id', 0)}
+    archive_all_users()
+    if CATCH_UP_ON_RESTART:
+        await catch_up_pending_updates(application)
+    setup_scheduler(application)
+    setup_session_lifecycle(application)
+
+async def post_shutdown(application):
+    """Сохраняет high-water mark при остановке"""
+    persist_update_state(application.bot_data)
+
+# ========== ИНСТРУМЕНТИРОВАНИЕ ОБРАБОТЧИКОВ ==========
+SLOW_HANDLER_MS = 500
+
+def log_handler_timing(callback):
+    """Оборачивает обработчик: время выполнения и результат пишутся в лог
+
+    Обычные вызовы логируются на уровне DEBUG (с семплированием), медленные
+    и упавшие - всегда.
+    """
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        outcome = 'ok'
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            outcome = 'stop'
+            raise
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            latency_ms = round((time.perf_counter() - started) * 1000, 2)
+            metrics = get_tenant()['metrics']
+            metrics['handler_calls'] += 1
+            metrics['handler_ms'] += latency_ms
+            level = logging.DEBUG if outcome != 'error' and latency_ms < SLOW_HANDLER_MS else logging.WARNING
+            if logger.isEnabledFor(level):
+                user = getattr(update, 'effective_user', None)
+                logger.log(level, "handler", extra={
+                    'event': 'handler',
+                    'handler': callback.__name__,
+                    'user': hash_user_id(user.id) if user else None,
+                    'latency_ms': latency_ms,
+                    'outcome': outcome,
+                })
+    return wrapper
+
+def instrument_handlers(application):
+    """Подключает log_handler_timing ко всем зарегистрированным обработчикам"""
+    def instrument(handler):
+        if isinstance(handler, ConversationHandler):
+            for nested in [*handler.entry_points, *handler.fallbacks, *sum(handler.states.values(), [])]:
+                instrument(nested)
+        else:
+            handler.callback = log_handler_timing(handler.callback)
+    
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            instrument(handler)
+
 # ========== ЗАПУСК БОТА ==========
+def build_application(token, base_url=None, tenant=DEFAULT_TENANT):
+    """Создает приложение бота со всеми обработчиками"""
+    builder = Application.builder().token(token).post_init(post_init).post_shutdown(post_shutdown)
+    if base_url:
+        builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+    application = builder.build()
+    tenant['application'] = application
+    application.add_handler(TypeHandler(Update, tenant_admission), group=-2)
+    application.add_handler(TypeHandler(Update, track_update_id), group=-1)
+    application.job_queue.run_repeating(persist_update_state_job, STATE_SAVE_INTERVAL, name="persist_update_state")
+    
+    # Обработчик диалога тренировки
+    conv_handler = ConversationHandler(
+        entry_points=[CommandHandler('train', start_training_command)],
+        states={
+            CHOOSING_DAY: [MessageHandler(filters.Regex('^(День А|День Б)$'), show_exercise_list)],
+            CHOOSING_EXERCISE: [
+                CallbackQueryHandler(handle_exercise_selection, pattern='^(ex_|progress|finish|reminders|ai_advice|quick_copy|repeat_last|timer_|back_to_exercises)')
+            ],
+            ENTERING_EXERCISE_DATA: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_exercise_input),
+                CallbackQueryHandler(handle_exercise_selection, pattern='^(progress|finish|reminders|ai_advice|quick_copy|repeat_last|timer_|back_to_exercises)')
+            ]
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+    )
+    
+    # Обработчик диалога взвешивания
+    weight_handler = ConversationHandler(
+        entry_points=[CommandHandler('weight', weight_command)],
+        states={
+            WEIGHING: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_weight_input)]
+        },
+        fallbacks=[CommandHandler('cancel', cancel_weight)],
+    )
+    
+    # Регистрируем обработчики. Взвешивание идет раньше общего /cancel и
+    # диалога тренировки: пока ждем вес, и ввод, и /cancel относятся к нему
+    application.add_handler(weight_handler)
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("progress", view_progress))
+    application.add_handler(CommandHandler("stats", view_stats))
+    application.add_handler(CommandHandler("advice", ai_advice_command))
+    application.add_handler(CommandHandler("chart", chart_command))
+    application.add_handler(CallbackQueryHandler(handle_chart_selection, pattern='^chart_'))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("export_all", export_all_command))
+    application.add_handler(CommandHandler("import", import_command))
+    application.add_handler(CommandHandler("remind", remind_command))
+    application.add_handler(CommandHandler("join", join_command, filters=filters.ChatType.GROUPS))
+    application.add_handler(CommandHandler("leave", leave_command, filters=filters.ChatType.GROUPS))
+    application.add_handler(CommandHandler("top", top_command, filters=filters.ChatType.GROUPS))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("cancel", cancel))
+    application.add_handler(conv_handler)
+    application.add_error_handler(error_handler)
+    
+    instrument_handlers(application)
+    return application
+
+# ========== НЕСКОЛЬКО БОТОВ В ОДНОМ ПРОЦЕССЕ ==========
+# Все боты из BOTS_CONFIG работают в одном event loop и делят HTTP-сервер
+# health-check, код хранилища (каждый со своим каталогом данных), очередь
+# рассылок и метрики. Бот, который занимает event loop дольше своей доли
+# max_share, придерживается, пока у других ботов есть очередь обновлений.
+def load_bots_config(path):
+    """Читает список ботов и возвращает [(tenant, токен, адрес Bot API)]
+
+    Формат: [{"name": "brand", "token_env": "BRAND_TOKEN", "data_dir": "data/brand",
+    "base_url": "...", "max_share": 0.5}]. Вместо token_env можно указать token;
+    data_dir по умолчанию - имя бота, base_url и max_share необязательны.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    
+    bots = []
+    names = set()
+    default_share = TENANT_MAX_SHARE if len(entries) > 1 else 1.0
+    for entry in entries:
+        name = entry['name']
+        if name in names:
+            raise ValueError(f"Бот {name} указан дважды")
+        names.add(name)
+        base_url = entry.get('base_url') or BOT_API_BASE_URL
+        token = entry.get('token') or os.environ.get(entry.get('token_env', '')) or (FAKE_BOT_TOKEN if base_url else None)
+        if not token:
+            raise ValueError(f"Не найден токен бота {name}")
+        tenant = new_tenant(name, entry.get('data_dir', name), entry.get('max_share', default_share))
+        bots.append((tenant, token, base_url))
+    return bots
+
+def enter_tenant(tenant):
+    """Делает бота текущим для задачи asyncio и всех задач, которые она создаст"""
+    current_tenant.set(tenant)
+    log_context.set({'tenant': tenant['name']})
+
+async def start_tenant(tenant, token, base_url):
+    """Запускает бота так же, как run_polling, но в общем event loop"""
+    enter_tenant(tenant)
+    os.makedirs(tenant['data_dir'] or '.', exist_ok=True)
+    application = build_application(token, base_url, tenant)
+    try:
+        await application.initialize()
+        await post_init(application)
+        await application.updater.start_polling(drop_pending_updates=not CATCH_UP_ON_RESTART, allowed_updates=Update.ALL_TYPES)
+        await application.start()
+    except Exception:
+        await application.shutdown()
+        tenant['application'] = None
+        raise
+    logger.info("✅ Бот запущен", extra={'event': 'startup'})
+
+async def stop_tenant(tenant):
+    """Останавливает бота и сохраняет его состояние"""
+    enter_tenant(tenant)
+    application = tenant['application']
+    drop_outbox(tenant)
+    if application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    await post_shutdown(application)
+    await application.shutdown()
+
+async def run_hosted_bots(bots):
+    """Запускает всех ботов, ждет SIGINT/SIGTERM и останавливает их"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    # gather запускает каждого бота в отдельной задаче со своим контекстом
+    results = await asyncio.gather(*(start_tenant(*bot) for bot in bots), return_exceptions=True)
+    running = []
+    for (tenant, _, _), result in zip(bots, results):
+        if isinstance(result, Exception):
+            logger.critical(f"❌ Бот {tenant['name']} не запущен: {result}", exc_info=result,
+                            extra={'event': 'startup', 'tenant': tenant['name']})
+        else:
+            running.append(tenant)
+    if not running:
+        raise RuntimeError("Не запущен ни один бот")
+    logger.info(f"✅ Запущено ботов: {len(running)} из {len(bots)}", extra={'event': 'startup'})
+    
+    await stop.wait()
+    await asyncio.gather(*(stop_tenant(tenant) for tenant in running), return_exceptions=True)
+
 def main():
     """Основная функция запуска бота"""
-    print("🤖 Бот запускается...")
+    logger.info("🤖 Бот запускается...", extra={'event': 'startup'})
     
-    if not BOT_TOKEN:
-        print("❌ Не могу запустить бота без BOT_TOKEN")
-        return
+    if BOTS_CONFIG:
+        try:
+            bots = load_bots_config(BOTS_CONFIG)
+        except (OSError, ValueError, KeyError) as e:
+            logger.critical(f"❌ Ошибка в {BOTS_CONFIG}: {e}", extra={'event': 'startup'})
+            sys.exit(1)
+        hosted_tenants[:] = [tenant for tenant, _, _ in bots]
+    else:
+        token = BOT_TOKEN or (FAKE_BOT_TOKEN if BOT_API_BASE_URL else None)
+        if not token:
+            logger.critical("❌ ОШИБКА: BOT_TOKEN не найден!", extra={'event': 'startup'})
+            sys.exit(1)
+    
+    # load_user_data принимает нечитаемый файл за пустую базу, и первое же
+    # сохранение затерло бы данные, поэтому такой файл нужно сначала проверить
+    for tenant in hosted_tenants:
+        data_file = os.path.join(tenant['data_dir'], DATA_FILE)
+        problem = startup_problem(data_file, os.path.join(tenant['data_dir'], ARCHIVE_DIR))
+        if problem:
+            logger.critical(f"❌ Запуск отменен: {problem}. Проверка и восстановление: python check_store.py {data_file} --repair fixed.json",
+                            extra={'event': 'startup', 'tenant': tenant['name']})
+            sys.exit(1)
     
     try:
         # Запускаем Flask в отдельном потоке для health checks
         flask_thread = Thread(target=run_flask, daemon=True)
         flask_thread.start()
-        print("✅ HTTP сервер для health checks запущен на порту 5000")
-        
-        application = Application.builder().token(BOT_TOKEN).build()
-        
-        # Обработчик диалога тренировки
-        conv_handler = ConversationHandler(
-            entry_points=[CommandHandler('train', start_training_command)],
-            states={
-                CHOOSING_DAY: [MessageHandler(filters.Regex('^(День А|День Б)$'), show_exercise_list)],
-                CHOOSING_EXERCISE: [
-                    CallbackQueryHandler(handle_exercise_selection, pattern='^(ex_|progress|finish|reminders|ai_advice|quick_copy|repeat_last|timer_|back_to_exercises)')
-                ],
-                ENTERING_EXERCISE_DATA: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_exercise_input),
-                    CallbackQueryHandler(handle_exercise_selection, pattern='^(progress|finish|reminders|ai_advice|quick_copy|repeat_last|timer_|back_to_exercises)')
-                ]
-            },
-            fallbacks=[CommandHandler('cancel', cancel)],
-        )
+        logger.info(f"✅ HTTP сервер для health checks запущен на порту {HEALTH_PORT}", extra={'event': 'startup'})
         
-        # Регистрируем обработчики
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("progress", view_progress))
-        application.add_handler(CommandHandler("stats", view_stats))
-        application.add_handler(CommandHandler("advice", ai_advice_command))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("cancel", cancel))
-        application.add_handler(conv_handler)
-        application.add_error_handler(error_handler)
+        if BOTS_CONFIG:
+            asyncio.run(run_hosted_bots(bots))
+            return
         
-        print("✅ Бот успешно запущен и готов к работе!")
+        application = build_application(token, BOT_API_BASE_URL)
+        if BOT_API_BASE_URL:
+            logger.info(f"Используется Bot API по адресу {BOT_API_BASE_URL}", extra={'event': 'startup'})
+        logger.info("✅ Бот успешно запущен и готов к работе!", extra={'event': 'startup'})
         
-        application.run_polling(drop_pending_updates=True)
+        application.run_polling(drop_pending_updates=not CATCH_UP_ON_RESTART, allowed_updates=Update.ALL_TYPES)
         
     except Exception as e:
-        print(f"❌ Ошибка при запуске бота: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.critical(f"❌ Ошибка при запуске бота: {e}", exc_info=True, extra={'event': 'startup'})
         sys.exit(1)
 
 if __name__ == '__main__':
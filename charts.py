@@ -0,0 +1,122 @@
+import struct
+import zlib
+
+# ========== ОТРИСОВКА ГРАФИКОВ ==========
+# Графики рисуются без внешних библиотек: линии растеризуются в буфер RGB
+# и упаковываются в PNG через zlib.
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+BACKGROUND = (255, 255, 255)
+AXIS_COLOR = (180, 180, 180)
+GRID_COLOR = (235, 235, 235)
+LINE_COLORS = [(33, 150, 243), (244, 67, 54), (76, 175, 80)]
+
+CHART_WIDTH = 480
+CHART_HEIGHT = 240
+CHART_PADDING = 16
+
+
+def sparkline(values):
+    """Возвращает компактный unicode-график для ряда значений"""
+    if not values:
+        return ""
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARK_CHARS[len(SPARK_CHARS) // 2] * len(values)
+    scale = (len(SPARK_CHARS) - 1) / (high - low)
+    return "".join(SPARK_CHARS[round((value - low) * scale)] for value in values)
+
+
+class _Canvas:
+    """Простой RGB-холст с рисованием линий"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(BACKGROUND * (width * height))
+
+    def set_pixel(self, x, y, color):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            offset = (y * self.width + x) * 3
+            self.pixels[offset:offset + 3] = bytes(color)
+
+    def hline(self, y, color):
+        row = bytes(color) * self.width
+        offset = y * self.width * 3
+        self.pixels[offset:offset + len(row)] = row
+
+    def line(self, x0, y0, x1, y1, color, thickness=2):
+        """Отрезок по алгоритму Брезенхэма"""
+        dx, dy = abs(x1 - x0), -abs(y1 - y0)
+        sx = 1 if x0 < x1 else -1
+        sy = 1 if y0 < y1 else -1
+        error = dx + dy
+        while True:
+            for t in range(thickness):
+                self.set_pixel(x0, y0 + t, color)
+                self.set_pixel(x0 + t, y0, color)
+            if x0 == x1 and y0 == y1:
+                break
+            doubled = 2 * error
+            if doubled >= dy:
+                error += dy
+                x0 += sx
+            if doubled <= dx:
+                error += dx
+                y0 += sy
+
+    def to_png(self):
+        """Кодирует холст в PNG"""
+        stride = self.width * 3
+        raw = b"".join(
+            b"\x00" + bytes(self.pixels[y * stride:(y + 1) * stride])
+            for y in range(self.height)
+        )
+
+        def chunk(kind, data):
+            body = kind + data
+            return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+
+        header = struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0)
+        return (
+            b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(raw, 6))
+            + chunk(b"IEND", b"")
+        )
+
+
+def render_line_chart(series, width=CHART_WIDTH, height=CHART_HEIGHT):
+    """Рисует один или несколько рядов значений на общей шкале и возвращает PNG
+
+    series - список списков значений; подписи добавляются в текст сообщения.
+    """
+    canvas = _Canvas(width, height)
+    values = [value for line in series for value in line]
+    if not values:
+        return canvas.to_png()
+
+    low, high = min(values), max(values)
+    if high == low:
+        low, high = low - 1, high + 1
+    plot_width = width - 2 * CHART_PADDING
+    plot_height = height - 2 * CHART_PADDING
+
+    for step in range(5):
+        canvas.hline(CHART_PADDING + plot_height * step // 4, GRID_COLOR)
+    canvas.hline(height - CHART_PADDING, AXIS_COLOR)
+
+    for index, line in enumerate(series):
+        color = LINE_COLORS[index % len(LINE_COLORS)]
+        points = []
+        for i, value in enumerate(line):
+            x = CHART_PADDING + (plot_width * i // (len(line) - 1) if len(line) > 1 else plot_width // 2)
+            y = CHART_PADDING + round((high - value) / (high - low) * plot_height)
+            points.append((x, y))
+        if len(points) == 1:
+            canvas.line(*points[0], *points[0], color, thickness=4)
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            canvas.line(x0, y0, x1, y1, color)
+
+    return canvas.to_png()
@@ -0,0 +1,431 @@
+"""Проверка целостности и восстановление файла данных пользователей.
+
+Файл читается потоково (записи пользователей по одной, без загрузки всего
+JSON в память) и режется на текстовые фрагменты записей, а разбор и проверка
+фрагментов идут параллельно на всех ядрах. Проверяются схема записи,
+ISO-даты, индексы completed_exercises относительно программы тренировок,
+повторы тренировок и отрицательные веса. Исправленная копия пишется так же
+потоково.
+
+Запуск: python check_store.py user_data.json [--repair fixed.json] [--report issues.jsonl] [--workers N]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from collections import Counter
+from datetime import datetime
+
+READ_CHUNK = 1 << 20
+PRETTY_START = '{\n  "'
+RECORD_START = '\n  "'
+BATCH_SIZE = 200
+REPORT_EXAMPLES = 3
+
+_programs = {}
+_archive_dir = None
+
+
+# ========== ПОТОКОВОЕ ЧТЕНИЕ ==========
+def iter_store(fileobj, chunk_size=READ_CHUNK):
+    """Читает JSON-объект верхнего уровня по парам (user_id, запись)
+
+    Ошибки формата (включая обрезанный файл) поднимают ValueError.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+
+    def fill(size):
+        nonlocal buffer, position, eof
+        chunk = fileobj.read(size)
+        if not chunk:
+            eof = True
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def next_char():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or eof:
+                return buffer[position] if position < len(buffer) else ''
+            fill(chunk_size)
+
+    def decode():
+        # Значение может не поместиться в буфер - тогда дочитываем, удваивая порцию
+        nonlocal position
+        size = chunk_size
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                if end < len(buffer) or eof:
+                    position = end
+                    return value
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ValueError(f"Некорректный JSON: {e}") from None
+            fill(size)
+            size *= 2
+
+    if next_char() != '{':
+        raise ValueError("Файл пуст или не является JSON-объектом")
+    position += 1
+    if next_char() == '}':
+        return
+    while True:
+        if next_char() != '"':
+            raise ValueError("Ожидался идентификатор пользователя")
+        user_id = decode()
+        if next_char() != ':':
+            raise ValueError(f"Ожидалось ':' после {user_id!r}")
+        position += 1
+        next_char()
+        yield user_id, decode()
+        separator = next_char()
+        position += 1
+        if separator == '}':
+            return
+        if separator != ',':
+            raise ValueError(f"Файл обрезан или поврежден после записи {user_id!r}")
+
+
+def iter_fragments(fileobj, chunk_size=READ_CHUNK):
+    """Выдает текст записей пользователей вида '"id": {...}'
+
+    Файл, записанный save_user_data (indent=2), режется без разбора JSON:
+    только ключ верхнего уровня начинается с новой строки и ровно двух
+    пробелов перед кавычкой, а перевода строки внутри строк JSON быть не
+    может. Файл с другой разметкой разбирается потоково в этом процессе.
+    Обрезанная или поврежденная запись попадает к проверке как есть.
+    """
+    if fileobj.read(len(PRETTY_START)) != PRETTY_START:
+        fileobj.seek(0)
+        for user_id, record in iter_store(fileobj, chunk_size):
+            yield json.dumps(user_id, ensure_ascii=False) + ': ' + json.dumps(record, ensure_ascii=False)
+        return
+
+    buffer = PRETTY_START[2:]
+    start = 0
+    while True:
+        end = buffer.find(RECORD_START, start + 1)
+        if end != -1:
+            yield buffer[start:end]
+            start = end + 1
+            continue
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        buffer = buffer[start:] + chunk
+        start = 0
+
+    tail = buffer[start:].rstrip()
+    yield tail[:-2] if tail.endswith('\n}') else tail
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ========== ПРОВЕРКИ ==========
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_iso(value):
+    if not isinstance(value, str):
+        return False
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _check_exercise(exercise, path, issues):
+    """Проверяет упражнение; возвращает False, если его нужно удалить"""
+    if not isinstance(exercise, dict) or not isinstance(exercise.get('name'), str):
+        issues.append((path, 'schema', "упражнение без названия"))
+        return False
+    if not _is_number(exercise.get('weight')) or not isinstance(exercise.get('reps'), int):
+        issues.append((path, 'schema', "нет веса или повторений"))
+        return False
+    if exercise['weight'] < 0 or exercise['reps'] < 0:
+        issues.append((path, 'negative_weight', f"{exercise['weight']}кг × {exercise['reps']}"))
+        return False
+    if 'timestamp' in exercise and not _is_iso(exercise['timestamp']):
+        issues.append((f"{path}.timestamp", 'bad_date', repr(exercise['timestamp'])))
+        exercise.pop('timestamp')
+    if 'sets' in exercise:
+        sets = exercise['sets']
+        valid = [s for s in sets if isinstance(s, dict) and _is_number(s.get('weight')) and s['weight'] >= 0
+                 and isinstance(s.get('reps'), int) and s['reps'] >= 0] if isinstance(sets, list) else []
+        if not isinstance(sets, list) or len(valid) != len(sets):
+            issues.append((f"{path}.sets", 'schema', "некорректные подходы удалены"))
+            exercise['sets'] = valid
+    return True
+
+
+def _check_session(session, path, issues):
+    """Проверяет тренировку; возвращает False, если ее нужно удалить"""
+    if not isinstance(session, dict) or not isinstance(session.get('day'), str):
+        issues.append((path, 'schema', "тренировка без дня"))
+        return False
+    if not isinstance(session.get('exercises'), list):
+        issues.append((f"{path}.exercises", 'schema', "нет списка упражнений"))
+        session['exercises'] = []
+    session['exercises'] = [
+        exercise for i, exercise in enumerate(session['exercises'])
+        if _check_exercise(exercise, f"{path}.exercises[{i}]", issues)
+    ]
+
+    for field in ('start_time', 'last_activity'):
+        if field in session and not _is_iso(session[field]):
+            issues.append((f"{path}.{field}", 'bad_date', repr(session[field])))
+            session.pop(field)
+    if 'start_time' not in session:
+        # Время начала восстанавливается по первому упражнению
+        timestamps = [exercise['timestamp'] for exercise in session['exercises'] if 'timestamp' in exercise]
+        if not timestamps:
+            issues.append((path, 'bad_date', "нет времени начала"))
+            return False
+        session['start_time'] = min(timestamps)
+
+    program = _programs.get(session['day'])
+    if program is None:
+        issues.append((f"{path}.day", 'unknown_day', session['day']))
+    if 'completed_exercises' in session:
+        completed = session['completed_exercises']
+        count = len(program['exercises']) if program else 0
+        valid = []
+        for index in completed if isinstance(completed, list) else []:
+            if type(index) is int and 0 <= index < count and index not in valid:
+                valid.append(index)
+        if valid != completed:
+            issues.append((f"{path}.completed_exercises", 'bad_index', repr(completed)))
+            session['completed_exercises'] = valid
+    return True
+
+
+def _report_weight_points(issues, malformed, non_positive):
+    # Испорченные точки (даты, типы, длины рядов) и неположительный вес - разные проблемы
+    if malformed:
+        issues.append(('weight_history', 'bad_weight_point', f"удалено испорченных взвешиваний: {malformed}"))
+    if non_positive:
+        issues.append(('weight_history', 'negative_weight', f"удалено взвешиваний с весом <= 0: {non_positive}"))
+
+
+def _check_weight_history(record, issues):
+    weight_history = record['weight_history']
+    if isinstance(weight_history, list):
+        wellformed = [point for point in weight_history
+                      if isinstance(point, dict) and _is_iso(point.get('date')) and _is_number(point.get('weight'))]
+        valid = [point for point in wellformed if point['weight'] > 0]
+        if len(valid) != len(weight_history):
+            _report_weight_points(issues, len(weight_history) - len(wellformed), len(wellformed) - len(valid))
+            record['weight_history'] = valid
+        return
+    if (not isinstance(weight_history, dict) or not isinstance(weight_history.get('t'), list)
+            or not isinstance(weight_history.get('w'), list)):
+        issues.append(('weight_history', 'schema', "ожидался ряд {'t': [...], 'w': [...]}"))
+        record['weight_history'] = {'t': [], 'w': []}
+        return
+    points = list(zip(weight_history['t'], weight_history['w']))
+    wellformed = [(t, w) for t, w in points if type(t) is int and _is_number(w)]
+    valid = [(t, w) for t, w in wellformed if w > 0]
+    # Точки без пары (ряды t и w разной длины) тоже испорчены
+    unpaired = max(len(weight_history['t']), len(weight_history['w'])) - len(points)
+    if len(valid) != len(points) or unpaired:
+        _report_weight_points(issues, len(points) - len(wellformed) + unpaired, len(wellformed) - len(valid))
+        record['weight_history'] = {'t': [t for t, _ in valid], 'w': [w for _, w in valid]}
+
+
+def _check_archive(user_id, record, issues):
+    archived = record['archived']
+    if (not isinstance(archived, dict) or type(archived.get('sessions')) is not int
+            or type(archived.get('bytes')) is not int or not isinstance(archived.get('days'), dict)):
+        issues.append(('archived', 'schema', "некорректное описание архива"))
+        return
+    if _archive_dir is None or not archived['bytes']:
+        return
+    path = os.path.join(_archive_dir, f"{user_id}.jsonl.gz")
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if size < archived['bytes']:
+        issues.append(('archived', 'archive_truncated', f"{size} из {archived['bytes']} байт"))
+
+
+def check_record(user_id, record):
+    """Проверяет запись пользователя
+
+    Возвращает (список проблем (путь, код, описание), исправленная запись
+    или None, если запись восстановить нельзя). Запись изменяется на месте.
+    """
+    issues = []
+    if not isinstance(record, dict):
+        issues.append(('', 'schema', f"запись имеет тип {type(record).__name__}"))
+        return issues, None
+    if not isinstance(record.get('username', ''), str):
+        issues.append(('username', 'schema', repr(record['username'])))
+        record['username'] = str(record['username'])
+    if not isinstance(record.get('history'), list):
+        issues.append(('history', 'schema', "нет списка тренировок"))
+        record['history'] = []
+
+    history = []
+    seen = set()
+    for i, session in enumerate(record['history']):
+        path = f"history[{i}]"
+        if not _check_session(session, path, issues):
+            continue
+        key = (session['day'], session['start_time'])
+        if key in seen:
+            issues.append((path, 'duplicate_session', f"{session['day']} {session['start_time']}"))
+            continue
+        seen.add(key)
+        history.append(session)
+    record['history'] = history
+
+    if 'current_session' in record and not _check_session(record['current_session'], 'current_session', issues):
+        record.pop('current_session')
+    if 'weight_history' in record:
+        _check_weight_history(record, issues)
+    if 'archived' in record:
+        _check_archive(user_id, record, issues)
+    return issues, record
+
+
+def _init_worker(programs, archive_dir):
+    global _programs, _archive_dir
+    _programs = programs
+    _archive_dir = archive_dir
+
+
+def _check_fragment(fragment, repair):
+    """Разбирает и проверяет фрагмент
+
+    Возвращает (user_id, проблемы, текст исправленной записи). Вместо текста
+    - False, если запись восстановить нельзя, и None без восстановления.
+    """
+    try:
+        (user_id, record), = json.loads('{' + fragment.rstrip().rstrip(',') + '}').items()
+    except ValueError as e:
+        try:
+            user_id = json.JSONDecoder().raw_decode(fragment.lstrip())[0]
+        except ValueError:
+            user_id = '?'
+        return user_id, [('', 'corrupt', f"запись не читается: {e}")], False
+
+    issues, record = check_record(user_id, record)
+    if record is None:
+        return user_id, issues, False
+    if not repair:
+        return user_id, issues, None
+    # Отступы как у вложенного объекта в save_user_data (indent=2)
+    text = json.dumps(record, ensure_ascii=False, indent=2).replace('\n', '\n  ')
+    return user_id, issues, f"  {json.dumps(user_id, ensure_ascii=False)}: {text}"
+
+
+def _check_batch(args):
+    batch, repair = args
+    return [_check_fragment(fragment, repair) for fragment in batch]
+
+
+# ========== ОТЧЕТ И ВОССТАНОВЛЕНИЕ ==========
+def check_store(path, programs, repair_path=None, report_path=None, workers=None, archive_dir=None):
+    """Проверяет файл данных и возвращает сводку {'users', 'damaged', 'issues': Counter}
+
+    Если задан repair_path, туда пишется исправленная копия; report_path -
+    все найденные проблемы в формате JSON Lines.
+    """
+    summary = {'users': 0, 'damaged': 0, 'dropped': 0, 'issues': Counter(), 'examples': {}}
+    repaired = open(repair_path, 'w', encoding='utf-8') if repair_path else None
+    report = open(report_path, 'w', encoding='utf-8') if report_path else None
+    try:
+        with open(path, 'r', encoding='utf-8') as f, multiprocessing.Pool(
+                workers, initializer=_init_worker, initargs=(programs, archive_dir)) as pool:
+            written = 0
+            batches = ((batch, bool(repaired)) for batch in _batches(iter_fragments(f), BATCH_SIZE))
+            for results in pool.imap(_check_batch, batches):
+                for user_id, issues, record in results:
+                    summary['users'] += 1
+                    if issues:
+                        summary['damaged'] += 1
+                    for issue_path, code, message in issues:
+                        summary['issues'][code] += 1
+                        examples = summary['examples'].setdefault(code, [])
+                        if len(examples) < REPORT_EXAMPLES:
+                            examples.append(f"{user_id} {issue_path}: {message}")
+                        if report:
+                            report.write(json.dumps({'user': user_id, 'path': issue_path, 'code': code,
+                                                     'message': message}, ensure_ascii=False) + '\n')
+                    if record is False:
+                        summary['dropped'] += 1
+                    elif repaired:
+                        repaired.write((',\n' if written else '{\n') + record)
+                        written += 1
+            if repaired:
+                repaired.write('\n}' if written else '{}')
+    finally:
+        for output in (repaired, report):
+            if output:
+                output.close()
+    return summary
+
+
+def startup_problem(path, archive_dir=None):
+    """Причина не запускать бота над файлом данных или None
+
+    Пустой или нечитаемый файл бот раньше молча принимал за пустую базу и
+    при первом сохранении затирал им данные пользователей.
+    """
+    if not os.path.exists(path):
+        return None
+    if os.path.getsize(path) == 0:
+        return f"{path} пуст (обрезан до нуля)"
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (ValueError, UnicodeDecodeError) as e:
+        return f"{path} поврежден: {e}"
+    if not isinstance(data, dict):
+        return f"{path} не является JSON-объектом"
+    if not data and archive_dir and os.path.isdir(archive_dir) and os.listdir(archive_dir):
+        return f"{path} не содержит пользователей, но в {archive_dir} есть их архивы"
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Проверка целостности user_data.json")
+    parser.add_argument('path')
+    parser.add_argument('--repair', help="куда записать исправленную копию")
+    parser.add_argument('--report', help="куда записать все проблемы (JSON Lines)")
+    parser.add_argument('--workers', type=int, default=None, help="число процессов (по умолчанию - все ядра)")
+    parser.add_argument('--archive-dir', default='archive', help="каталог архивов тренировок")
+    args = parser.parse_args()
+
+    from bot import TRAINING_PROGRAMS
+    try:
+        result = check_store(args.path, TRAINING_PROGRAMS, args.repair, args.report, args.workers, args.archive_dir)
+    except ValueError as e:
+        print(f"❌ {args.path}: {e}")
+        sys.exit(2)
+
+    print(f"Пользователей: {result['users']}, с проблемами: {result['damaged']}, "
+          f"не восстановить: {result['dropped']}")
+    for code, count in result['issues'].most_common():
+        print(f"  {code}: {count}")
+        for example in result['examples'][code]:
+            print(f"    {example}")
+    if args.repair:
+        print(f"Исправленная копия: {args.repair}")
+    sys.exit(1 if result['damaged'] else 0)
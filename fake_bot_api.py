@@ -0,0 +1,301 @@
+"""Локальная замена Telegram Bot API для офлайн-тестов производительности.
+
+Сервер понимает getMe, getUpdates (с long polling), setWebhook,
+deleteWebhook, sendMessage, editMessageText, answerCallbackQuery,
+sendPhoto и sendDocument. Задержку ответа и долю ответов 429 можно
+настроить. Бот подключается к нему через BOT_API_BASE_URL.
+
+Запуск: python fake_bot_api.py [--port 8081] [--latency 0.05] [--rate-429 0.01]
+"""
+import argparse
+import email.parser
+import email.policy
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_ID = 1000000
+BOT_USERNAME = 'fake_workout_bot'
+MAX_UPDATES_PER_POLL = 100
+
+
+def _parse_body(content_type, body):
+    """Разбирает параметры запроса (JSON, urlencoded или multipart)"""
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename():
+                params[name] = {'filename': part.get_filename(), 'size': len(part.get_payload(decode=True))}
+            else:
+                params[name] = _decode_value(part.get_content())
+        return params
+    return {key: _decode_value(value) for key, value in urllib.parse.parse_qsl(body.decode('utf-8'))}
+
+
+def _decode_value(value):
+    """Значения параметров python-telegram-bot кодирует в JSON"""
+    try:
+        return json.loads(value)
+    except (ValueError, TypeError):
+        return value
+
+
+class FakeBotApi:
+    """Состояние поддельного Bot API: очередь обновлений, отправленные сообщения, статистика"""
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_429=0.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.condition = threading.Condition()
+        self.updates = []
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.file_ids = itertools.count(1)
+        self.webhook_url = ''
+        self.sent = []
+        self.calls = {}
+        self.throttled = 0
+
+    # ---------- Обновления ----------
+    def push_update(self, update):
+        """Ставит обновление в очередь getUpdates и возвращает его update_id"""
+        with self.condition:
+            update['update_id'] = next(self.update_ids)
+            self.updates.append(update)
+            self.condition.notify_all()
+        return update['update_id']
+
+    def push_text(self, user_id, text, chat_id=None, chat_type='private'):
+        """Ставит в очередь текстовое сообщение от пользователя"""
+        chat_id = chat_id or user_id
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': chat_type, 'title': 'Fake group'} if chat_type != 'private'
+            else {'id': chat_id, 'type': 'private', 'first_name': f"User{user_id}"},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"},
+            'text': text,
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return self.push_update({'message': message})
+
+    def push_callback(self, user_id, data, message_id=None):
+        """Ставит в очередь нажатие inline-кнопки"""
+        return self.push_update({'callback_query': {
+            'id': str(next(self.message_ids)),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"},
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id or next(self.message_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private', 'first_name': f"User{user_id}"},
+                'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bot'},
+                'text': '...',
+            },
+        }})
+
+    def pending_updates(self):
+        """Число неподтвержденных обновлений"""
+        with self.condition:
+            return len(self.updates)
+
+    def wait_for_sent(self, count, timeout=30.0):
+        """Ждет, пока бот отправит не меньше count сообщений"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while len(self.sent) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    # ---------- Методы API ----------
+    def call(self, method, params):
+        """Выполняет метод API и возвращает (HTTP-статус, тело ответа)"""
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+        if method != 'getUpdates' and self.rate_429 and self.random.random() < self.rate_429:
+            self.throttled += 1
+            return 429, {
+                'ok': False, 'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after},
+            }
+
+        handler = getattr(self, f"_api_{method}", None)
+        result = handler(params) if handler else True
+        return 200, {'ok': True, 'result': result}
+
+    def _api_getMe(self, params):
+        return {'id': BOT_ID, 'is_bot': True, 'first_name': 'Fake Workout Bot', 'username': BOT_USERNAME,
+                'can_join_groups': True, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+
+    def _api_getUpdates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = min(int(params.get('limit') or MAX_UPDATES_PER_POLL), MAX_UPDATES_PER_POLL)
+        deadline = time.monotonic() + float(params.get('timeout') or 0)
+        with self.condition:
+            # Как и настоящий API, offset подтверждает все обновления до него
+            if offset:
+                self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            while not self.updates and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+            return self.updates[:limit]
+
+    def _api_setWebhook(self, params):
+        self.webhook_url = params.get('url', '')
+        return True
+
+    def _api_deleteWebhook(self, params):
+        self.webhook_url = ''
+        if params.get('drop_pending_updates'):
+            with self.condition:
+                self.updates.clear()
+        return True
+
+    def _api_getWebhookInfo(self, params):
+        return {'url': self.webhook_url, 'has_custom_certificate': False, 'pending_update_count': self.pending_updates()}
+
+    def _record_message(self, method, params, **fields):
+        chat_id = params.get('chat_id')
+        message = {
+            'message_id': params.get('message_id') or next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'Fake Workout Bot'},
+            **fields,
+        }
+        with self.condition:
+            self.sent.append({'method': method, 'chat_id': chat_id, 'time': time.monotonic(), 'params': params})
+            self.condition.notify_all()
+        return message
+
+    def _api_sendMessage(self, params):
+        return self._record_message('sendMessage', params, text=params.get('text', ''))
+
+    def _api_editMessageText(self, params):
+        return self._record_message('editMessageText', params, text=params.get('text', ''))
+
+    def _api_answerCallbackQuery(self, params):
+        return True
+
+    def _new_file(self):
+        number = next(self.file_ids)
+        return {'file_id': f"fake-file-{number}", 'file_unique_id': f"fake-unique-{number}"}
+
+    def _api_sendPhoto(self, params):
+        photo = [dict(self._new_file(), width=480, height=240)]
+        return self._record_message('sendPhoto', params, photo=photo, caption=params.get('caption'))
+
+    def _api_sendDocument(self, params):
+        document = self._new_file()
+        upload = params.get('document')
+        if isinstance(upload, dict):
+            document.update(file_name=upload['filename'], file_size=upload['size'])
+        return self._record_message('sendDocument', params, document=document)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """HTTP-обработчик маршрутов /bot<token>/<method>"""
+
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело пишутся отдельно; без TCP_NODELAY keep-alive-соединение
+    # ловит задержку подтверждения (~40 мс) на каждом запросе
+    disable_nagle_algorithm = True
+
+    def _handle(self):
+        api = self.server.api
+        path = urllib.parse.urlparse(self.path)
+        parts = path.path.strip('/').split('/')
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        params = _parse_body(self.headers.get('Content-Type', ''), self.rfile.read(length))
+        params.update({key: _decode_value(value) for key, value in urllib.parse.parse_qsl(path.query)})
+
+        status, payload = api.call(parts[1], params)
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBotApiServer(ThreadingHTTPServer):
+    """HTTP-сервер поддельного Bot API, запускаемый в фоновом потоке"""
+
+    daemon_threads = True
+
+    def __init__(self, api=None, host='127.0.0.1', port=0):
+        super().__init__((host, port), _RequestHandler)
+        self.api = api or FakeBotApi()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        """Адрес для BOT_API_BASE_URL"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        # Бот закрывает соединение long polling при остановке - это не ошибка
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Поддельный Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, с")
+    parser.add_argument('--jitter', type=float, default=0.0, help="случайная добавка к задержке, с")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    server = FakeBotApiServer(FakeBotApi(args.latency, args.jitter, args.rate_429, args.retry_after), args.host, args.port)
+    print(f"Fake Bot API: {server.base_url} (BOT_API_BASE_URL={server.base_url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,315 @@
+"""Экспорт и импорт истории пользователей в колоночном бинарном формате.
+
+Файл состоит из сигнатуры и последовательности кадров. Каждый кадр - это
+порция строк одной таблицы, в которой значения лежат по столбцам и сжаты
+zlib. Первый кадр содержит JSON-схему, поэтому файл самоописываемый.
+
+Запуск: python history_export.py check user_data.json
+"""
+import io
+import json
+import struct
+import sys
+import zlib
+
+MAGIC = b'WBX1'
+# Версия 2: строки словаря хранятся с длинами, а не через разделитель \x00
+FORMAT_VERSION = 2
+CHUNK_ROWS = 8192
+COMPRESSION_LEVEL = 6
+
+SCHEMA_FRAME = 0
+END_FRAME = 255
+
+# Таблицы и их столбцы. Поля записи, не попавшие в столбцы (или имеющие
+# неожиданный тип), сохраняются в столбце extra как JSON, поэтому экспорт
+# не теряет данные.
+TABLES = {
+    'users': [('user_id', 'str'), ('username', 'str'), ('extra', 'str')],
+    'sessions': [('user_id', 'str'), ('day', 'str'), ('start_time', 'str'), ('extra', 'str')],
+    'exercises': [('session', 'i64'), ('name', 'str'), ('weight', 'f64'), ('reps', 'i64'),
+                  ('timestamp', 'str'), ('extra', 'str')],
+    'weights': [('user_id', 'str'), ('t', 'i64'), ('w', 'f64')],
+}
+TABLE_IDS = {name: index for index, name in enumerate(TABLES, 1)}
+TABLE_NAMES = {index: name for name, index in TABLE_IDS.items()}
+TABLE_PARENTS = {'sessions': 'users', 'exercises': 'sessions', 'weights': 'users'}
+
+_TYPE_CHECKS = {'str': str, 'f64': float, 'i64': int}
+_NUMERIC_FORMATS = {'f64': 'd', 'i64': 'q'}
+I64_MIN, I64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def _fits(kind, value):
+    """Значение можно записать в столбец без потерь"""
+    if type(value) is not _TYPE_CHECKS[kind]:
+        return False
+    return kind != 'i64' or I64_MIN <= value <= I64_MAX
+
+
+# ========== КОДИРОВАНИЕ СТОЛБЦОВ ==========
+def _encode_column(kind, values):
+    """Кодирует столбец; строки - словарем уникальных значений и индексами"""
+    if kind in _NUMERIC_FORMATS:
+        return struct.pack(f'<{len(values)}{_NUMERIC_FORMATS[kind]}', *values)
+
+    dictionary = {}
+    indexes = [dictionary.setdefault(value, len(dictionary)) for value in values]
+    encoded = [word.encode('utf-8') for word in dictionary]
+    words = b''.join(encoded)
+    return (struct.pack('<II', len(dictionary), len(words))
+            + struct.pack(f'<{len(encoded)}I', *map(len, encoded)) + words
+            + struct.pack(f'<{len(indexes)}I', *indexes))
+
+
+def _decode_column(kind, data, rows, version=FORMAT_VERSION):
+    """Декодирует столбец из байтов"""
+    if kind in _NUMERIC_FORMATS:
+        return list(struct.unpack(f'<{rows}{_NUMERIC_FORMATS[kind]}', data))
+
+    size, words_length = struct.unpack_from('<II', data)
+    if version < 2:
+        words = data[8:8 + words_length].decode('utf-8')
+        dictionary = words.split('\x00') if size else []
+        offset = 8 + words_length
+    else:
+        lengths = struct.unpack_from(f'<{size}I', data, 8)
+        offset = 8 + 4 * size
+        dictionary = []
+        for length in lengths:
+            dictionary.append(data[offset:offset + length].decode('utf-8'))
+            offset += length
+    indexes = struct.unpack_from(f'<{rows}I', data, offset)
+    return [dictionary[index] for index in indexes]
+
+
+def _split_record(record, columns, nested=()):
+    """Раскладывает словарь на значения столбцов и JSON с остальными полями
+
+    Вложенные поля (nested) пишутся отдельными таблицами; если их нет в
+    записи, это отмечается, чтобы при чтении не появились пустые значения.
+    """
+    values = []
+    extra = {}
+    missing = [name for name in nested if name not in record]
+    for name, kind in columns:
+        if name == 'extra':
+            continue
+        value = record.get(name)
+        if _fits(kind, value):
+            values.append(value)
+        else:
+            values.append(_TYPE_CHECKS[kind]())
+            if name in record:
+                extra[name] = value
+            else:
+                missing.append(name)
+    column_names = {name for name, _ in columns}
+    for key, value in record.items():
+        if key not in column_names and key not in nested:
+            extra[key] = value
+    if missing:
+        extra['__missing__'] = missing
+    values.append(json.dumps(extra, ensure_ascii=False) if extra else '')
+    return values
+
+
+def _join_record(columns, row, defaults=None):
+    """Собирает словарь из значений столбцов и JSON с остальными полями"""
+    record = defaults or {}
+    extra = {}
+    for (name, _), value in zip(columns, row):
+        if name == 'extra':
+            extra = json.loads(value) if value else {}
+        else:
+            record[name] = value
+    for name in extra.pop('__missing__', []):
+        record.pop(name, None)
+    record.update(extra)
+    return record
+
+
+# ========== ЗАПИСЬ ==========
+def _is_weight_series(weight_history):
+    """Ряд веса, который можно записать таблицей weights без потерь"""
+    return (isinstance(weight_history, dict) and set(weight_history) == {'t', 'w'}
+            and isinstance(weight_history['t'], list) and isinstance(weight_history['w'], list)
+            and len(weight_history['t']) == len(weight_history['w'])
+            and all(_fits('i64', t) for t in weight_history['t'])
+            and all(type(w) in (int, float) for w in weight_history['w']))
+
+
+class ExportWriter:
+    """Потоковая запись таблиц порциями по CHUNK_ROWS строк"""
+
+    def __init__(self, fileobj, chunk_rows=CHUNK_ROWS):
+        self.fileobj = fileobj
+        self.chunk_rows = chunk_rows
+        self.buffers = {name: [] for name in TABLES}
+        self.session_count = 0
+        fileobj.write(MAGIC)
+        schema = {'version': FORMAT_VERSION, 'tables': TABLES}
+        self._write_frame(SCHEMA_FRAME, json.dumps(schema).encode('utf-8'))
+
+    def _write_frame(self, frame_id, payload):
+        compressed = zlib.compress(payload, COMPRESSION_LEVEL)
+        self.fileobj.write(struct.pack('<BI', frame_id, len(compressed)))
+        self.fileobj.write(compressed)
+
+    def _append(self, table, row):
+        buffer = self.buffers[table]
+        buffer.append(row)
+        if len(buffer) >= self.chunk_rows:
+            self._flush_table(table)
+
+    def _flush_table(self, table):
+        rows = self.buffers[table]
+        if not rows:
+            return
+        # Строки ссылаются на родительскую таблицу, поэтому она пишется раньше
+        if table in TABLE_PARENTS:
+            self._flush_table(TABLE_PARENTS[table])
+        parts = [struct.pack('<I', len(rows))]
+        for index, (_, kind) in enumerate(TABLES[table]):
+            column = _encode_column(kind, [row[index] for row in rows])
+            parts.append(struct.pack('<I', len(column)))
+            parts.append(column)
+        self._write_frame(TABLE_IDS[table], b''.join(parts))
+        self.buffers[table] = []
+
+    def add_user(self, user_id, record, history=None):
+        """Добавляет пользователя; history позволяет передать полную историю отдельно"""
+        if history is None:
+            history = record.get('history', [])
+        weight_history = record.get('weight_history')
+        # Старый формат истории веса (список словарей) и ряды с неожиданными
+        # типами (например, нецелые метки времени) уходят в extra как есть
+        columnar = 'weight_history' not in record or _is_weight_series(weight_history)
+        nested = ('history', 'weight_history') if columnar else ('history',)
+        self._append('users', [user_id] + _split_record(record, TABLES['users'][1:], nested))
+
+        for session in history:
+            self._append('sessions', [user_id] + _split_record(
+                session, TABLES['sessions'][1:], ('exercises',)))
+            for exercise in session.get('exercises', []):
+                self._append('exercises', [self.session_count] + _split_record(
+                    exercise, TABLES['exercises'][1:]))
+            self.session_count += 1
+
+        if columnar and weight_history:
+            for timestamp, weight in zip(weight_history['t'], weight_history['w']):
+                self._append('weights', [user_id, timestamp, weight])
+
+    def close(self):
+        """Сбрасывает остатки буферов и пишет завершающий кадр"""
+        for table in TABLES:
+            self._flush_table(table)
+        self._write_frame(END_FRAME, b'')
+
+
+def write_export(fileobj, users):
+    """Записывает пары (user_id, запись) в файл экспорта"""
+    writer = ExportWriter(fileobj)
+    for user_id, record in users:
+        writer.add_user(user_id, record)
+    writer.close()
+
+
+# ========== ЧТЕНИЕ ==========
+def _read_frames(fileobj):
+    """Читает кадры файла экспорта"""
+    if fileobj.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Неизвестный формат файла экспорта")
+    while True:
+        header = fileobj.read(5)
+        if len(header) < 5:
+            raise ValueError("Файл экспорта обрезан")
+        frame_id, length = struct.unpack('<BI', header)
+        payload = zlib.decompress(fileobj.read(length))
+        if frame_id == END_FRAME:
+            return
+        yield frame_id, payload
+
+
+def _decode_table(columns, payload, version):
+    """Декодирует кадр таблицы в список строк"""
+    rows = struct.unpack_from('<I', payload)[0]
+    offset = 4
+    decoded = []
+    for _, kind in columns:
+        length = struct.unpack_from('<I', payload, offset)[0]
+        offset += 4
+        decoded.append(_decode_column(kind, payload[offset:offset + length], rows, version))
+        offset += length
+    return list(zip(*decoded))
+
+
+def read_export(fileobj):
+    """Читает файл экспорта и возвращает словарь user_id -> запись
+
+    Любое повреждение файла (обрезанный или испорченный поток zlib, неверные
+    длины и ссылки) сообщается как ValueError.
+    """
+    try:
+        return _read_users(fileobj)
+    except (zlib.error, struct.error, IndexError, KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Файл экспорта поврежден ({type(e).__name__}: {e})") from e
+
+
+def _read_users(fileobj):
+    """Собирает записи пользователей из кадров файла экспорта"""
+    users = {}
+    sessions = []
+    tables = None
+    version = FORMAT_VERSION
+
+    for frame_id, payload in _read_frames(fileobj):
+        if frame_id == SCHEMA_FRAME:
+            schema = json.loads(payload)
+            version = schema['version']
+            if version > FORMAT_VERSION:
+                raise ValueError("Файл экспорта создан более новой версией бота")
+            tables = {name: [tuple(column) for column in columns] for name, columns in schema['tables'].items()}
+            continue
+        if tables is None:
+            raise ValueError("В файле экспорта нет схемы")
+
+        table = TABLE_NAMES[frame_id]
+        columns = tables[table]
+        for row in _decode_table(columns, payload, version):
+            if table == 'users':
+                record = _join_record(columns, row, {'history': [], 'weight_history': {'t': [], 'w': []}})
+                users[record.pop('user_id')] = record
+            elif table == 'sessions':
+                session = _join_record(columns, row, {'exercises': []})
+                users[session.pop('user_id')]['history'].append(session)
+                sessions.append(session)
+            elif table == 'exercises':
+                exercise = _join_record(columns, row)
+                sessions[exercise.pop('session')]['exercises'].append(exercise)
+            elif table == 'weights':
+                user_id, timestamp, weight = row
+                users[user_id]['weight_history']['t'].append(timestamp)
+                users[user_id]['weight_history']['w'].append(weight)
+
+    return users
+
+
+def check_roundtrip(user_data):
+    """Экспортирует данные в память, читает обратно и сравнивает с исходными"""
+    buffer = io.BytesIO()
+    write_export(buffer, user_data.items())
+    size = buffer.tell()
+    buffer.seek(0)
+    return read_export(buffer) == user_data, size
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != 'check':
+        print(__doc__)
+        sys.exit(2)
+    with open(sys.argv[2], 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    ok, size = check_roundtrip(data)
+    print(f"{'✅' if ok else '❌'} {len(data)} пользователей, {size} байт")
+    sys.exit(0 if ok else 1)
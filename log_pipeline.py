@@ -0,0 +1,115 @@
+import atexit
+import contextvars
+import copy
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+
+# ========== НЕБЛОКИРУЮЩЕЕ СТРУКТУРИРОВАННОЕ ЛОГИРОВАНИЕ ==========
+# Обработчики бота только кладут запись в очередь (QueueHandler), а запись в
+# stdout выполняет отдельный поток QueueListener. Поэтому медленный stdout на
+# хостинге не останавливает event loop. Записи выводятся одной строкой JSON.
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', '0.01'))
+LOG_QUEUE_SIZE = 10000
+LOG_USER_SALT = os.environ.get('LOG_USER_SALT', '')
+
+# Поля, которые можно передать через extra={...} и которые попадут в JSON
+STRUCTURED_FIELDS = ('event', 'user', 'handler', 'latency_ms', 'outcome', 'chat', 'tenant')
+
+# Поля, общие для всех записей текущей задачи asyncio (например, tenant -
+# имя бота при размещении нескольких ботов в одном процессе)
+log_context = contextvars.ContextVar('log_context', default=None)
+
+_listener = None
+_traceback_formatter = logging.Formatter()
+
+
+def hash_user_id(user_id):
+    """Обезличенный идентификатор пользователя для логов"""
+    return hashlib.sha256(f"{LOG_USER_SALT}{user_id}".encode('utf-8')).hexdigest()[:12]
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись лога одной строкой JSON"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Пропускает лишь долю DEBUG-записей, остальные уровни - полностью"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при переполнении очереди отбрасывает запись, а не ждет"""
+
+    def prepare(self, record):
+        # Текст исключения сохраняется отдельно, чтобы он попал в поле exc
+        record = copy.copy(record)
+        # Контекст задачи доступен только в потоке, который пишет запись
+        for field, value in (log_context.get() or {}).items():
+            if getattr(record, field, None) is None:
+                setattr(record, field, value)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def setup_logging():
+    """Настраивает очередь логов и фоновый поток вывода (повторный вызов ничего не делает)"""
+    global _listener
+    if _listener:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    # httpx пишет строку на каждый запрос к Bot API
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,98 @@
+import re
+
+# ========== РАЗБОР ВВОДА ПОДХОДОВ ==========
+# Все шаблоны компилируются один раз при импорте модуля, чтобы разбор
+# сообщения в обработчике занимал доли миллисекунды.
+
+MAX_INPUT_LENGTH = 500
+MAX_SETS_PER_MESSAGE = 50
+MAX_WEIGHT = 1000.0
+MAX_REPS = 1000
+MAX_SET_COUNT = 20
+LB_TO_KG = 0.45359237
+
+_NUMBER = r'\d+(?:[.,]\d+)?'
+_WEIGHT_UNIT = r'(?P<unit>кг|kg|lbs?|фунт\w*)\.?'
+_REPS_UNIT = r'(?:повт\w*\.?|раз\w*|reps?|р\b\.?|r\b)'
+_SETS_UNIT = r'(?:подх\w*|сет\w*|sets?)'
+_TIMES = r'[x×х*]'
+
+SET_PATTERN = re.compile(
+    rf'(?P<weight>{_NUMBER})\s*(?:{_WEIGHT_UNIT})?'
+    rf'(?:\s*(?:{_TIMES}|на|по)\s*|\s+)'
+    rf'(?P<reps>\d+)(?:\s*{_REPS_UNIT})?'
+    rf'(?:\s*{_TIMES}\s*(?P<sets>\d+)(?:\s*{_SETS_UNIT})?|\s+(?P<sets_word>\d+)\s*{_SETS_UNIT})?',
+    re.IGNORECASE
+)
+SEPARATOR_PATTERN = re.compile(r'(?:[\s,;/+]|\bи\b|\band\b)*', re.IGNORECASE)
+WEIGHT_PATTERN = re.compile(rf'^\s*(?P<weight>{_NUMBER})\s*(?:{_WEIGHT_UNIT})?\s*$', re.IGNORECASE)
+
+
+def _to_float(value):
+    """Преобразует число с точкой или запятой в float"""
+    return float(value.replace(',', '.'))
+
+
+def _weight_in_kg(value, unit):
+    """Переводит вес в килограммы с учетом единицы измерения"""
+    weight = _to_float(value)
+    if unit and unit.lower().startswith(('lb', 'фунт')):
+        weight = round(weight * LB_TO_KG, 2)
+    return weight
+
+
+def parse_sets(text):
+    """Разбирает сообщение с подходами в список пар (вес, повторения)
+
+    Поддерживаются форматы "60 10", "60кг 10", "60*10", "60x10x3",
+    "60,5 на 8", "135lb x 5" и несколько подходов через запятую,
+    точку с запятой или перенос строки. При ошибке выбрасывается ValueError.
+    """
+    text = text.strip()
+    if not text:
+        raise ValueError("Пустое сообщение")
+    if len(text) > MAX_INPUT_LENGTH:
+        raise ValueError("Слишком длинное сообщение")
+
+    sets = []
+    position = 0
+    for match in SET_PATTERN.finditer(text):
+        if not SEPARATOR_PATTERN.fullmatch(text, position, match.start()):
+            raise ValueError(f"Не удалось распознать «{text[position:match.start()].strip()}»")
+        position = match.end()
+
+        weight = _weight_in_kg(match.group('weight'), match.group('unit'))
+        reps = int(match.group('reps'))
+        set_count = int(match.group('sets') or match.group('sets_word') or 1)
+
+        if weight <= 0 or reps <= 0 or set_count <= 0:
+            raise ValueError("Числа должны быть положительными")
+        if weight > MAX_WEIGHT or reps > MAX_REPS or set_count > MAX_SET_COUNT:
+            raise ValueError("Слишком большие значения")
+
+        sets.extend([(weight, reps)] * set_count)
+        if len(sets) > MAX_SETS_PER_MESSAGE:
+            raise ValueError("Слишком много подходов в одном сообщении")
+
+    if not sets:
+        raise ValueError("Нужно ввести вес и количество повторений")
+    if not SEPARATOR_PATTERN.fullmatch(text, position):
+        raise ValueError(f"Не удалось распознать «{text[position:].strip()}»")
+
+    return sets
+
+
+def parse_weight(text):
+    """Разбирает сообщение с весом тела, например "82,5" или "82.5кг\""""
+    match = WEIGHT_PATTERN.match(text)
+    if not match:
+        raise ValueError("Введите вес числом, например 82.5")
+    weight = _weight_in_kg(match.group('weight'), match.group('unit'))
+    if weight <= 0 or weight > MAX_WEIGHT:
+        raise ValueError("Вес должен быть положительным числом")
+    return weight
+
+
+def best_set(sets):
+    """Возвращает самый тяжелый подход (при равном весе - с большим числом повторений)"""
+    return max(sets, key=lambda s: (s[0], s[1]))